@@ -1,3 +1,12 @@
+import atexit
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                TimeoutError)
+
 import dash  # pip install dash==1.21.0
 import dash_bootstrap_components as dbc  # pip install dash_bootstrap_components==0.12.2
 import dash_core_components as dcc  # pip install dash_core_components==1.17.1
@@ -5,175 +14,780 @@ import dash_html_components as html  # pip install dash_html_components==1.1.4
 import pandas as pd  # pip install pandas==1.2.3
 import plotly.express as px  # pip install plotly==5.1.0
 import plotly.graph_objects as go
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import gunicorn  # pip install gunicorn==20.1.0
+import numpy as np  # pip install numpy==1.21.1
+from flask_compress import Compress  # pip install Flask-Compress==1.10.1
+import flask  # pip install Flask==2.0.1
+from plotly.utils import PlotlyJSONEncoder
+
+import metrics
+import permit_cache
+import permit_pipeline
+from figure_bundle import FigureBundle
+from figure_cache import FigureCache
+from map_bins import color_cols
+from permit_data import PermitData
+from permit_refresh import PermitRefresher
+from request_profiler import profile_slow_requests
+from selection_counts import SelectionCounts
+from spatial_index import cap_points, map_viewport
+
+# Data source and columnar cache location, overridable per deploy
+PERMITS_CSV = os.environ.get('PERMITS_CSV', 'Building_Permit_Map.csv')
+PERMITS_CACHE_DIR = os.environ.get('PERMITS_CACHE_DIR', 'permit_cache')
+# Shared-data mode: gunicorn preloads the app (see gunicorn.conf.py) so the
+# workers share the master's data, and the cache columns are memory-mapped
+PERMITS_SHARED = os.environ.get('PERMITS_SHARED', '0') == '1'
+PERMITS_CACHE_MMAP = os.environ.get('PERMITS_CACHE_MMAP',
+                                    '1' if PERMITS_SHARED else '0') == '1'
+FIGURE_CACHE_SIZE = int(os.environ.get('FIGURE_CACHE_SIZE', '128'))
+MAP_POINT_CAP = int(os.environ.get('MAP_POINT_CAP', '25000'))
+# Below this zoom the map draws binned counts instead of points; 0 disables
+MAP_BIN_ZOOM = int(os.environ.get('MAP_BIN_ZOOM', '11'))
+# Brotli responses and compact go-built map traces instead of px ones
+LEAN_PAYLOAD = os.environ.get('LEAN_PAYLOAD', '1') == '1'
+# Lean map points carry only a PermitNum; details are fetched on hover/click
+MAP_LAZY_DETAILS = os.environ.get('MAP_LAZY_DETAILS', '1') == '1'
+# Poll the CSV (or PERMITS_REFRESH_URL) for a new export; 0 disables
+PERMITS_REFRESH_SECONDS = int(os.environ.get('PERMITS_REFRESH_SECONDS', '0'))
+PERMITS_REFRESH_URL = os.environ.get('PERMITS_REFRESH_URL') or None
+# Keep a profile of every request slower than this; 0 disables profiling
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILER = os.environ.get('PROFILER', 'cprofile')   # or 'pyinstrument'
+# Pre-render the default views plus the WARMUP_TOP_N most requested cached
+# figures at startup and after each reload; SELECTION_COUNTS_PATH keeps the
+# request counts across restarts ('' keeps them in memory only)
+WARMUP_TOP_N = int(os.environ.get('WARMUP_TOP_N', '20'))
+WARMUP_THREADS = int(os.environ.get('WARMUP_THREADS', '2'))
+SELECTION_COUNTS_PATH = os.environ.get('SELECTION_COUNTS_PATH',
+                                       'selection_counts.json')
+# Figures pre-rendered by prerender.py, served when they match the data
+PRERENDERED_DIR = os.environ.get('PRERENDERED_DIR', 'prerendered')
+# Build the map and both bar figures in one request, concurrently on a pool
+# of FIGURE_POOL_SIZE threads; 'processes' also renders them in as many
+# forked processes. Unset keeps one request per figure.
+FIGURE_POOL = os.environ.get('FIGURE_POOL', '')   # 'threads' or 'processes'
+FIGURE_POOL_SIZE = int(os.environ.get('FIGURE_POOL_SIZE', '3'))
+# Seconds to wait on a render process before rendering in-thread instead
+FIGURE_RENDER_TIMEOUT = float(os.environ.get('FIGURE_RENDER_TIMEOUT', '30'))
+
+# Settings that change the rendered figures; a pre-rendered bundle is only
+# used with the settings it was built with
+figure_settings = {'MAP_POINT_CAP': MAP_POINT_CAP,
+                   'MAP_BIN_ZOOM': MAP_BIN_ZOOM,
+                   'LEAN_PAYLOAD': LEAN_PAYLOAD,
+                   'MAP_LAZY_DETAILS': MAP_LAZY_DETAILS}
+
+# Load cleaned frames from the cache, rebuilding only when the CSV changed
+if PERMITS_CACHE_DIR:
+    frames, loaded_source_key = permit_cache.load_frames(
+        PERMITS_CSV, PERMITS_CACHE_DIR, memory_map=PERMITS_CACHE_MMAP)
+else:
+    loaded_source_key = permit_cache.source_key(PERMITS_CSV)
+    frames = permit_pipeline.build_frames(PERMITS_CSV)
+
+# Binned permit counts for the zoomed-out levels, from city-wide (8) upward
+bin_levels = (range(min(8, MAP_BIN_ZOOM - 1), MAP_BIN_ZOOM)
+              if MAP_BIN_ZOOM > 0 else ())
+
+# Permits, count cube, chart frames and indexes as one snapshot; callbacks
+# read it through this name and reload_permits swaps it whole
+with metrics.pipeline_seconds.time(stage='snapshot'):
+    permit_data = PermitData.from_frames(frames, bin_levels)
+del frames   # the long-form counts are only needed to rebuild the cube
+
+# Rendered figures per callback and inputs; invalidate on data reload
+figure_cache = FigureCache(maxsize=FIGURE_CACHE_SIZE)
 
-df = (pd.read_csv('Building_Permit_Map.csv'))
-
-not_active = ['Completed', 'Closed', 'Expired', 'Canceled', 'Withdrawn']
-df_active = df[~df['StatusCurrent'].isin(not_active)]
-
-permit_class_remap = {'Commercial': 'Non-Residential',
-                      'Institutional': 'Non-Residential',
-                      'Industrial': 'Non-Residential',
-                      'Vacant Land': 'Non-Residential'}
-df_active['PermitClassMapRes'] = (df_active['PermitClass']
-                                  .replace(permit_class_remap))
-
-df_active = df_active[~df_active['OriginalZip'].isna()]
-df_active['OriginalZip'] = df_active['OriginalZip'].astype(int)
-df_has_loc = df_active[~df_active['Latitude'].isna()]
-df_has_loc = df_has_loc[df_has_loc.OriginalZip != 0]
-
-# Fill null values
-df_has_loc['EstProjectCost'].fillna('Unknown', inplace=True)
-df_has_loc['HousingUnitsAdded'].fillna(0, inplace=True)
-df_has_loc['HousingUnitsRemoved'].fillna(0, inplace=True)
-
-# Remove unneeded columns
-cols = ['PermitNum', 'PermitClassMapRes', 'PermitTypeDesc',
-        'HousingUnitsRemoved', 'HousingUnitsAdded', 'OriginalZip',
-        'Longitude', 'Latitude', 'EstProjectCost', 'PermitClassMapped']
-df_has_loc = df_has_loc[cols]
-
-# Filter to just Additions, New, and Demo permits
-df_has_loc = df_has_loc[df_has_loc['PermitTypeDesc'].isin(
-                                ['Addition/Alteration', 'New', 'Demolition'])]
-# Check final nulls
-df_has_loc.isna().sum()
-
-# Remove 22 rows with missing class
-df_has_loc = df_has_loc.dropna()
-
-# Convert zips to strings
-df_has_loc = df_has_loc.astype(dtype={'OriginalZip': 'str'})
-
-# Make list of unique zips
-unique_zips = df_has_loc['OriginalZip'].drop_duplicates().sort_values().tolist()
-
-# Group and count permit types per Zip for charts
-type_grouper = (df_has_loc.groupby(['OriginalZip',
-                                   'PermitTypeDesc', 'PermitClassMapRes'])['PermitNum']
-                .count().reset_index())
-type_mapper = {'PermitNum': 'PermitTypeCount',
-               'PermitClassMapRes': 'PermitClass'}
-type_grouper = type_grouper.rename(mapper=type_mapper, axis='columns')
-
-# Group and count permit type per Zip
-zip_type_g = (df_has_loc.groupby(['OriginalZip',
-                                  'PermitTypeDesc'])['PermitNum']
-              .count().reset_index())
-zip_type_g = zip_type_g.rename(mapper={'PermitNum': 'PermitTypeCount'},
-                               axis='columns')
-
-# Count total type permits per zip
-zip_t_g = zip_type_g.groupby('OriginalZip')['PermitTypeCount'].sum().reset_index()
-zip_t_g = zip_t_g.rename(mapper={'PermitTypeCount': 'TotalTypePermit'},
-                         axis='columns')
-
-zip_type_g = zip_type_g.merge(zip_t_g, how='left', on='OriginalZip')
-
-# calc percent of each type permit per zip
-zip_type_g['pct_permit_type'] = round((zip_type_g['PermitTypeCount']
-                                      / zip_type_g['TotalTypePermit']), 4)
-
-# Group and count permit type per Zip
-zip_class_g = (df_has_loc.groupby(['OriginalZip',
-                                   'PermitClassMapRes'])['PermitNum']
-               .count().reset_index())
-zip_class_g = zip_class_g.rename(mapper={'PermitNum': 'PermitClassCount'},
-                                 axis='columns')
-
-# Count total class permits per zip and merge
-zip_c_g = (zip_class_g.groupby('OriginalZip')['PermitClassCount']
-           .sum().reset_index())
-zip_c_g = zip_c_g.rename(mapper={'PermitClassCount': 'TotalClassPermit'},
-                         axis='columns')
-zip_class_g = zip_class_g.merge(zip_c_g, how='left', on='OriginalZip')
-
-# calc percent of each class permit per zip
-zip_class_g['pct_permit_class'] = round((zip_class_g['PermitClassCount']
-                                         / zip_class_g['TotalClassPermit']), 4)
+
+# Fingerprint of the CSV permit_data was loaded from. It is recorded at
+# load time rather than read from the cache manifest, which another worker's
+# reload may since have rewritten for a newer CSV.
+def permit_source_key():
+    return loaded_source_key
+
+
+def open_prerendered(source_key=None):
+    if not PRERENDERED_DIR or not os.path.isdir(PRERENDERED_DIR):
+        return None
+    return FigureBundle.open(PRERENDERED_DIR,
+                             (source_key or permit_source_key())['sha256'],
+                             figure_settings)
+
+
+# All-zips and single-zip figures rendered offline for the current data
+prerendered_figures = open_prerendered()
+
+# Request counts per figure cache key, ranking what the warm-up renders
+selection_counts = SelectionCounts(SELECTION_COUNTS_PATH or None)
+atexit.register(selection_counts.save)
+warmup_pool = None
+# Pools of FIGURE_POOL, and the data snapshot the render processes forked with
+figure_pool = None
+render_processes = None
 
 # Dash app layout
 bg_color = '#f0f8ff'
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
+map_width = 700
+map_height = 800
+map_zoom = 10
+month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+               'Oct', 'Nov', 'Dec']
+class_colors = {"Single Family/Duplex": '#e9a3c9',
+                'Multifamily': '#c51b7d',
+                'Non-Residential': '#4d9221'}
+type_colors = {"New": '#2166ac',
+               'Demolition': '#b2182b',
+               'Addition/Alteration': '#67a9cf'}
+# Dash forces gzip-only compression, so set up Flask-Compress here instead
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY],
+                compress=False)
 server = app.server
+server.config['COMPRESS_ALGORITHM'] = (['br', 'gzip'] if LEAN_PAYLOAD
+                                       else ['gzip'])
+Compress(server)
+
+
+# Callback timing and payload size per output; registered after Compress so
+# the size is measured before compression
+@server.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
 
-app.layout = dbc.Container([
-    dbc.Row(
-        dbc.Col(
-            html.H1("Active Construction Permits in Seattle"),
-            style={'text-align': 'center'}), style={'margin-bottom': 25}
-            ),
-    dbc.Row(
-        [dbc.Col(dcc.Slider(id="type_or_class", min=0,
-                            max=1,
-                            step=1,
-                            marks=
-                            {0: "Class",
-                             1: "Type"},
-                            value=0),
-                 width={'size': 4, 'offset': 0, 'order': 1}
-                 ),
-         dbc.Col(dcc.Slider(id="pct_or_total", min=0,
-                            max=1,
-                            step=1,
-                            marks=
-                            {0: "Percent",
-                             1: "Total"},
-                            value=0),
-                 width={'size': 4, 'offset': 2, 'order': 2})]),
-    dbc.Row([
-        dbc.Col([dcc.Dropdown(id="slct_zip",
-                              options=[{'label': zip,
-                                       'value': zip} for zip in unique_zips
-                                       ], multi=True,
-                              value=[],
-                              placeholder='Select Zip Codes, All by Default'),
-                dcc.Graph(id='sea_permit_map', figure={})],
-                width=4),
-        dbc.Col([  # second columns for graphs
-                dcc.Graph(id='horizontal_bar_type', figure={}),
-                dcc.Graph(id='horizontal_bar_class', figure={}),
-                ], width=8),
-        ]),
-    dbc.Row(
-        dbc.Col(
-            html.H5("Datasource: https://data.seattle.gov/"),
-            style={'text-align': 'left'})
-            ),
-    dbc.Row(
-        dbc.Col(
-            html.H5("Dashboard by Clayton Brock"),
-            style={'text-align': 'left'})
-            ),
-], fluid=True, style={'backgroundColor': bg_color})
+
+@server.after_request
+def record_request_metrics(response):
+    if flask.request.path.endswith('/_dash-update-component'):
+        output = (flask.request.get_json(silent=True) or {}).get('output')
+        metrics.request_seconds.observe(
+            time.perf_counter() - flask.g.request_start, output=output)
+        metrics.response_bytes.observe(
+            response.calculate_content_length() or 0, output=output)
+    return response
+
+
+@server.route('/metrics')
+def serve_metrics():
+    return flask.Response(metrics.render(),
+                          mimetype='text/plain; version=0.0.4')
+
+
+if PROFILE_SLOW_MS > 0:
+    profile_slow_requests(server, PROFILE_SLOW_MS, PROFILE_DIR, PROFILER)
+
+
+# Month range control over the months permits were applied in (month numbers
+# since 1970-01), with about eight year marks. Disabled without dates.
+def month_range_slider(month_bounds):
+    if month_bounds is None:
+        return dcc.RangeSlider(id='month_range', min=0, max=0, value=None,
+                               disabled=True)
+    first, last = month_bounds
+    step = max(1, (last - first) // 12 // 8)
+    marks = {month: str(1970 + month // 12)
+             for month in range(first, last + 1)
+             if month % 12 == 0 and (month // 12) % step == 0}
+    return dcc.RangeSlider(id='month_range', min=first, max=last, step=1,
+                           value=[first, last], marks=marks,
+                           allowCross=False)
+
+
+# Built per page load so the zip list follows reloaded data
+def serve_layout():
+    return dbc.Container([
+        dbc.Row(
+            dbc.Col(
+                html.H1("Active Construction Permits in Seattle"),
+                style={'text-align': 'center'}), style={'margin-bottom': 25}
+                ),
+        dbc.Row(
+            [dbc.Col(dcc.Slider(id="type_or_class", min=0,
+                                max=1,
+                                step=1,
+                                marks=
+                                {0: "Class",
+                                 1: "Type"},
+                                value=0),
+                     width={'size': 4, 'offset': 0, 'order': 1}
+                     ),
+             dbc.Col(dcc.Slider(id="pct_or_total", min=0,
+                                max=1,
+                                step=1,
+                                marks=
+                                {0: "Percent",
+                                 1: "Total"},
+                                value=0),
+                     width={'size': 4, 'offset': 2, 'order': 2})]),
+        dbc.Row(
+            dbc.Col([html.Div(id='month_range_label'),
+                     month_range_slider(permit_data.month_bounds)]),
+            style={'margin-top': 15}),
+        dbc.Row([
+            dbc.Col([dcc.Dropdown(id="slct_zip",
+                                  options=[{'label': zip,
+                                            'value': zip}
+                                           for zip in permit_data.unique_zips
+                                           ], multi=True,
+                                  value=[],
+                                  placeholder='Select Zip Codes, All by Default'),
+                    dcc.Graph(id='sea_permit_map', figure={}),
+                    dcc.Store(id='map_viewport'),
+                    html.Div(id='permit_detail')],
+                    width=4),
+            dbc.Col([  # second columns for graphs
+                    dcc.Graph(id='horizontal_bar_type', figure={}),
+                    dcc.Graph(id='horizontal_bar_class', figure={}),
+                    dcc.Store(id='type_bar_figures'),
+                    dcc.Store(id='class_bar_figures'),
+                    ], width=8),
+            ]),
+        dbc.Row(
+            dbc.Col(
+                html.H5("Datasource: https://data.seattle.gov/"),
+                style={'text-align': 'left'})
+                ),
+        dbc.Row(
+            dbc.Col(
+                html.H5("Dashboard by Clayton Brock"),
+                style={'text-align': 'left'})
+                ),
+    ], fluid=True, style={'backgroundColor': bg_color})
+
+
+app.layout = serve_layout
 
 
 # In[19]:
 
 
+# Track the visible map bounds; a new zip selection recenters the map, so
+# it also resets the viewport to the whole selection
 @app.callback(
-    [Output(component_id='sea_permit_map', component_property='figure'),
-     Output(component_id='horizontal_bar_class', component_property='figure'),
-     Output(component_id='horizontal_bar_type', component_property='figure')],
+    Output(component_id='map_viewport', component_property='data'),
+    [Input(component_id='sea_permit_map', component_property='relayoutData'),
+     Input(component_id='slct_zip', component_property='value')],
+    [State(component_id='map_viewport', component_property='data')]
+)
+def update_viewport(relayout_data, slct_zip, viewport):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'slct_zip.value' in triggered:
+        return None
+    new_viewport = map_viewport(relayout_data, map_width, map_height)
+    if new_viewport is None:
+        return viewport
+    if new_viewport['zoom'] is None:   # pan events may omit the zoom
+        new_viewport['zoom'] = (viewport or {}).get('zoom')
+    return new_viewport
+
+
+# [start, stop) month numbers for a month_range value, or None when it spans
+# every month of data so that full-range figures share one cache entry
+def month_window(data, month_range):
+    if not month_range or data.month_bounds is None:
+        return None
+    first, last = data.month_bounds
+    start, end = int(month_range[0]), int(month_range[1])
+    if start <= first and end >= last:
+        return None
+    return start, end + 1
+
+
+# Register a per-figure callback, unless FIGURE_POOL has update_figures serve
+# its output; the function then stays a plain one update_figures calls
+def figure_callback(output, inputs):
+    if FIGURE_POOL:
+        return lambda callback: callback
+    return app.callback(output, inputs)
+
+
+@figure_callback(
+    Output(component_id='sea_permit_map', component_property='figure'),
     [Input(component_id='type_or_class', component_property='value'),
      Input(component_id='slct_zip', component_property='value'),
-     Input(component_id='pct_or_total', component_property='value')]
+     Input(component_id='map_viewport', component_property='data'),
+     Input(component_id='month_range', component_property='value')]
+)
+def update_map(type_class, slct_zip, viewport, month_range):
+    metrics.selected_zips.observe(len(slct_zip or []), callback='map')
+    data = permit_data
+    months = month_window(data, month_range)
+    if viewport is not None:   # pans and zooms are too varied to cache
+        return render_figure(data, 'map', slct_zip, type_class, months,
+                             viewport)
+    key = FigureCache.make_key('map', slct_zip, type_class, months)
+    selection_counts.record(key)
+    return cached_figure(key)
+
+
+# Details of the permit under the cursor or last clicked, looked up by the
+# PermitNum the lean map sends as customdata. A permit a reload removed
+# since the map was drawn shows nothing new.
+@app.callback(
+    Output(component_id='permit_detail', component_property='children'),
+    [Input(component_id='sea_permit_map', component_property='hoverData'),
+     Input(component_id='sea_permit_map', component_property='clickData')]
+)
+def show_permit_detail(hover_data, click_data):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    event = (click_data if 'sea_permit_map.clickData' in triggered
+             else hover_data)
+    if not event or not event.get('points'):
+        return dash.no_update
+    permit_num = event['points'][0].get('customdata')
+    if not isinstance(permit_num, str):
+        return dash.no_update   # binned markers and px points carry no id
+    permit = permit_data.permit_row(permit_num)
+    if permit is None:
+        return dash.no_update
+    return permit_detail_table(permit)
+
+
+def format_date(value):
+    return None if pd.isna(value) else value.strftime('%Y-%m-%d')
+
+
+def permit_detail_table(permit):
+    cost = permit['EstProjectCost']
+    try:
+        cost = '${:,.0f}'.format(float(cost))
+    except ValueError:
+        pass   # 'Unknown'
+    fields = [('Permit Number', permit['PermitNum']),
+              ('Zip Code', permit['OriginalZip']),
+              ('Address', permit['OriginalAddress1']),
+              ('Permit Type', permit['PermitTypeDesc']),
+              ('Permit Class', permit['PermitClassMapRes']),
+              ('Status', permit['StatusCurrent']),
+              ('Applied', format_date(permit['AppliedDate'])),
+              ('Issued', format_date(permit['IssuedDate'])),
+              ('Est. Project Cost', cost),
+              ('Housing Units Added', '{:.0f}'.format(
+                  permit['HousingUnitsAdded'])),
+              ('Housing Units Removed', '{:.0f}'.format(
+                  permit['HousingUnitsRemoved'])),
+              ('Description', permit['Description'])]
+    return dbc.Table(html.Tbody([
+        html.Tr([html.Th(label), html.Td('' if pd.isna(value) else value)])
+        for label, value in fields]), size='sm', borderless=True)
+
+
+# Bar charts ship both the percent and total figure for the selected zips;
+# the pct_or_total slider then switches between them in the browser
+@figure_callback(
+    Output(component_id='class_bar_figures', component_property='data'),
+    [Input(component_id='slct_zip', component_property='value'),
+     Input(component_id='month_range', component_property='value')]
+)
+def update_class_bars(slct_zip, month_range):
+    metrics.selected_zips.observe(len(slct_zip or []), callback='class_bars')
+    key = FigureCache.make_key('class_bars', slct_zip,
+                               month_window(permit_data, month_range))
+    selection_counts.record(key)
+    return cached_figure(key)
+
+
+@figure_callback(
+    Output(component_id='type_bar_figures', component_property='data'),
+    [Input(component_id='slct_zip', component_property='value'),
+     Input(component_id='month_range', component_property='value')]
+)
+def update_type_bars(slct_zip, month_range):
+    metrics.selected_zips.observe(len(slct_zip or []), callback='type_bars')
+    key = FigureCache.make_key('type_bars', slct_zip,
+                               month_window(permit_data, month_range))
+    selection_counts.record(key)
+    return cached_figure(key)
+
+
+# With FIGURE_POOL, one request returns the map and both bar figures, built
+# concurrently on figure_pool instead of in three requests that a sync
+# worker serves one after another. A new class/type or viewport only
+# rebuilds the map. Each figure's time and the request's total are recorded
+# as sections of the 'figures' callback.
+def update_figures(type_class, slct_zip, viewport, month_range):
+    triggered = {t['prop_id'] for t in dash.callback_context.triggered}
+    jobs = [('map', update_map,
+             (type_class, slct_zip, viewport, month_range))]
+    if not triggered <= {'type_or_class.value', 'map_viewport.data'}:
+        jobs += [('class_bars', update_class_bars, (slct_zip, month_range)),
+                 ('type_bars', update_type_bars, (slct_zip, month_range))]
+    with metrics.callback_seconds.time(callback='figures', section='total'):
+        futures = [figure_pool.submit(_timed_figure, name, callback, args)
+                   for name, callback, args in jobs]
+        figures = [future.result() for future in futures]
+    return figures + [dash.no_update] * (3 - len(figures))
+
+
+def _timed_figure(name, callback, args):
+    with metrics.callback_seconds.time(callback='figures', section=name):
+        return callback(*args)
+
+
+if FIGURE_POOL:
+    app.callback(
+        [Output(component_id='sea_permit_map', component_property='figure'),
+         Output(component_id='class_bar_figures', component_property='data'),
+         Output(component_id='type_bar_figures', component_property='data')],
+        [Input(component_id='type_or_class', component_property='value'),
+         Input(component_id='slct_zip', component_property='value'),
+         Input(component_id='map_viewport', component_property='data'),
+         Input(component_id='month_range', component_property='value')]
+    )(update_figures)
+
+
+month_range_text = """
+function(month_range) {
+    var names = %s;
+    var label = function(month) {
+        return names[month %% 12] + ' ' + (1970 + Math.floor(month / 12));
+    };
+    return month_range ? 'Applied ' + label(month_range[0]) + ' \u2013 '
+                         + label(month_range[1]) : 'Applied any time';
+}
+""" % str(month_names)
+
+app.clientside_callback(
+    month_range_text,
+    Output(component_id='month_range_label', component_property='children'),
+    [Input(component_id='month_range', component_property='value')]
+)
+
+
+select_bar_figure = """
+function(pct_total, figures) {
+    return figures ? figures[pct_total] : {};
+}
+"""
+
+app.clientside_callback(
+    select_bar_figure,
+    Output(component_id='horizontal_bar_class', component_property='figure'),
+    [Input(component_id='pct_or_total', component_property='value'),
+     Input(component_id='class_bar_figures', component_property='data')]
+)
+
+app.clientside_callback(
+    select_bar_figure,
+    Output(component_id='horizontal_bar_type', component_property='figure'),
+    [Input(component_id='pct_or_total', component_property='value'),
+     Input(component_id='type_bar_figures', component_property='data')]
 )
-def update_map(type_class, slct_zip, pct_total):
 
-    df1 = df_has_loc.copy()
-    # df2 = type_grouper.copy()  # for filtering on type and class
-    df3 = zip_type_g.copy()
-    df4 = zip_class_g.copy()
+
+# Cacheable figures by the name in their cache key. Each renderer takes the
+# data snapshot, the zip selection and the rest of the key's options; the
+# map also takes the viewport of an uncached live map.
+def render_map(data, slct_zip, type_class, months=None, viewport=None):
+    return figure_json(build_map(data, type_class, slct_zip, viewport,
+                                 months), 'map')
+
+
+def render_class_bars(data, slct_zip, months=None):
+    return [figure_json(build_class_bar(data, slct_zip, pct_total, months),
+                        'class_bars')
+            for pct_total in (0, 1)]
+
+
+def render_type_bars(data, slct_zip, months=None):
+    return [figure_json(build_type_bar(data, slct_zip, pct_total, months),
+                        'type_bars')
+            for pct_total in (0, 1)]
+
+
+figure_renderers = {'map': render_map,
+                    'class_bars': render_class_bars,
+                    'type_bars': render_type_bars}
+
+
+# Serve the figure for a FigureCache key. On a miss it comes from the
+# pre-rendered bundle if that has it, else is rendered from permit_data.
+# The cache version is read before the snapshot, so a figure built from
+# data that a reload replaced meanwhile is never stored as current.
+def cached_figure(key):
+    figure = figure_cache.get(key)
+    if figure is None:
+        version = figure_cache.version
+        data, bundle = permit_data, prerendered_figures
+        figure = bundle.get(key) if bundle is not None else None
+        if figure is None:
+            figure = render_figure(data, key[0], sorted(key[-1]), *key[1:-1])
+        figure_cache.put(key, figure, version)
+    return figure
+
+
+# Render a figure from a data snapshot in the calling thread or, when the
+# render processes forked with that snapshot, in one of them. Processes
+# return the figure as JSON text, parsed here for Dash to send. A pool that
+# a reload shut down after it was read here, or whose process died, falls
+# back to rendering in this thread. So does one that takes longer than
+# FIGURE_RENDER_TIMEOUT, which is then dropped as possibly deadlocked (see
+# start_render_processes) until the next reload forks a new one.
+def render_figure(data, name, *args):
+    processes = render_processes
+    if processes is not None and processes[1] is data:
+        try:
+            text = processes[0].submit(_render_json, name, args).result(
+                timeout=FIGURE_RENDER_TIMEOUT)
+        except TimeoutError:
+            stop_render_processes(processes)
+        except RuntimeError:   # shut down, or BrokenProcessPool
+            pass
+        else:
+            return json.loads(text)
+    return figure_renderers[name](data, *args)
+
+
+# Runs in a render process, on the permit_data it was forked with
+def _render_json(name, args):
+    return json.dumps(figure_renderers[name](permit_data, *args),
+                      cls=PlotlyJSONEncoder)
+
+
+# Fork FIGURE_POOL_SIZE render processes sharing the current snapshot's
+# pages, replacing any forked for an older snapshot. Requests already
+# submitted to the old pool still finish; new ones to it fall back in
+# render_figure.
+#
+# At startup this forks before any pool thread runs. After a reload it forks
+# from the refresher thread while request and pool threads are running, and
+# a lock one of them holds at that moment stays locked in the children.
+# Metric locks are reset after fork; a render stuck on any other lock hits
+# FIGURE_RENDER_TIMEOUT and the pool is dropped.
+def start_render_processes():
+    global render_processes
+    old, data = render_processes, permit_data
+    size = max(FIGURE_POOL_SIZE, 1)
+    pool = ProcessPoolExecutor(max_workers=size,
+                               mp_context=multiprocessing.get_context('fork'))
+    # Fork every worker now, not mid-request
+    for future in [pool.submit(int) for _ in range(size)]:
+        future.result()
+    render_processes = (pool, data)
+    if old is not None:
+        old[0].shutdown(wait=False)
+
+
+# Stop using a render pool that timed out, unless a reload replaced it
+def stop_render_processes(processes):
+    global render_processes
+    if render_processes is processes:
+        render_processes = None
+        print('render processes timed out; rendering in-thread until the '
+              'next reload')
+    # A deadlocked worker never exits by itself and would block shutdown;
+    # requests still queued on the pool then fail over to in-thread
+    for process in list(processes[0]._processes.values()):
+        process.terminate()
+    processes[0].shutdown(wait=False)
+
+
+def _warm_figure(key):
+    try:
+        cached_figure(key)
+    except Exception:
+        traceback.print_exc()
+
+
+# The all-zips views every first visit loads
+default_keys = [FigureCache.make_key('map', [], 0, None),
+                FigureCache.make_key('map', [], 1, None),
+                FigureCache.make_key('class_bars', [], None),
+                FigureCache.make_key('type_bars', [], None)]
+
+
+# Render the default views in the calling thread. This also builds plotly's
+# lazily created template objects, which are not safe to first touch from
+# several threads at once.
+def warm_default_figures():
+    for key in default_keys:
+        _warm_figure(key)
+
+
+# Queue the default views and the most requested figures for rendering on
+# the warm-up pool, so their first visitors hit the cache
+def warm_figure_cache():
+    if warmup_pool is None or WARMUP_TOP_N <= 0:
+        return
+    for key in dict.fromkeys(default_keys
+                             + selection_counts.top(WARMUP_TOP_N)):
+        if key[0] in figure_renderers:
+            warmup_pool.submit(_warm_figure, key)
+
+
+# Figure as the plain dict Dash sends back, timed as the callback's
+# serialize section (Dash's own JSON encoding shows up in request_seconds)
+def figure_json(figure, callback):
+    with metrics.callback_seconds.time(callback=callback, section='serialize'):
+        return figure.to_plotly_json()
+
+
+# Swap in a new CSV export: build a snapshot from it (logging its diff
+# against the running one), publish that with one assignment and drop the
+# figures rendered from the old one
+def reload_permits(csv_path, key=None):
+    global permit_data, prerendered_figures, loaded_source_key
+    key = key or permit_cache.source_key(csv_path)
+    new_df = permit_pipeline.load_permits(csv_path)
+    with metrics.pipeline_seconds.time(stage='snapshot'):
+        new_data, sizes = permit_data.apply_snapshot(new_df)
+    prerendered_figures = open_prerendered(key)
+    permit_data, loaded_source_key = new_data, key
+    if FIGURE_POOL == 'processes':
+        start_render_processes()
+    figure_cache.invalidate()
+    print('reloaded permits: {}'.format(sizes))
+    warm_figure_cache()
+    if PERMITS_CACHE_DIR:
+        permit_cache.write_cache(new_data.to_frames(), csv_path,
+                                 PERMITS_CACHE_DIR, key=key)
+
+
+# Figure pools, warm-up pool and refresher for one serving process. In
+# shared-data mode gunicorn calls this after forking each worker, as threads
+# do not survive the fork; a reload then gives that worker a private copy of
+# the new data.
+def start_background_tasks():
+    global warmup_pool, figure_pool
+    if FIGURE_POOL == 'processes':
+        start_render_processes()
+    if FIGURE_POOL:
+        # plotly express builds shared template objects on first use, which
+        # is not safe to do from several pool threads at once
+        px.bar(x=[0], y=[0])
+        figure_pool = ThreadPoolExecutor(max_workers=max(FIGURE_POOL_SIZE, 1),
+                                         thread_name_prefix='figure-build')
+    warmup_pool = ThreadPoolExecutor(max_workers=max(WARMUP_THREADS, 1),
+                                     thread_name_prefix='figure-warmup')
+    warm_figure_cache()
+    if PERMITS_REFRESH_SECONDS <= 0:
+        return
+    # The key of the data this process holds, which a worker forked after a
+    # sibling's reload inherited from the master
+    PermitRefresher(PERMITS_CSV, reload_permits,
+                    interval=PERMITS_REFRESH_SECONDS,
+                    url=PERMITS_REFRESH_URL,
+                    known_key=permit_source_key()).start()
+
+
+# Map of the selected zips. viewport ({'bounds', 'zoom'} from the
+# map_viewport store) limits it to what is visible; below MAP_BIN_ZOOM the
+# permits are drawn as binned counts, otherwise as at most MAP_POINT_CAP points.
+# months ([start, stop) month numbers) limits it to permits applied then.
+def build_map(data, type_class, slct_zip, viewport=None, months=None):
+    bounds = viewport['bounds'] if viewport else None
+    zoom = (viewport or {}).get('zoom') or map_zoom
+
+    binned = data.permit_bins is not None and zoom < MAP_BIN_ZOOM
+
+    with metrics.callback_seconds.time(callback='map', section='filter'):
+        if binned and months is None:
+            markers = data.permit_bins.bins(zoom, type_class, slct_zip,
+                                            bounds)
+        elif binned:
+            markers = data.permit_bins.bins_for_rows(
+                zoom, type_class, permit_positions(data, slct_zip, months),
+                bounds)
+        else:
+            markers = select_permits(data, slct_zip, bounds, months)
+    metrics.map_points.observe(len(markers),
+                               mode='bins' if binned else 'points')
 
 # -------MAP---------------------------
-    if bool(slct_zip) is False:
-        print('no zip')
-    else:
-        df1 = df1[df1['OriginalZip'].isin(slct_zip)]
+    with metrics.callback_seconds.time(callback='map', section='figure'):
+        if binned:
+            fig_map = build_binned_map(type_class, markers)
+        else:
+            fig_map = build_point_map(type_class, markers)
+
+        # uirevision keeps the user's pan/zoom across viewport-driven updates
+        fig_map.update_layout(uirevision=str(sorted(slct_zip or [])),
+                              showlegend=True,
+                              legend={'orientation': "h",
+                                      'yanchor': "bottom",
+                                      'y': 1.02,
+                                      'xanchor': "right",
+                                      'x': 1,
+                                      'title': '',
+                                      'itemsizing': 'constant',
+                                      'itemwidth': 30},
+                              paper_bgcolor=bg_color)
+    return fig_map
+
+
+# One marker per (grid cell, class or type) of bins, sized by its permit count
+def build_binned_map(type_class, bins):
+    color_col = color_cols[type_class]
+    label = ['Permit Class', 'Permit Type'][type_class]
+    colors = [class_colors, type_colors][type_class]
+    largest = max(bins['PermitCount'].max(), 1) if len(bins) else 1
+
+    fig_map = go.Figure()
+    for name, color in colors.items():
+        cell = bins[bins[color_col] == name]
+        fig_map.add_trace(go.Scattermapbox(
+                lon=np.round(cell['Longitude'], 5),
+                lat=np.round(cell['Latitude'], 5),
+                mode='markers',
+                name=name,
+                text=cell['PermitCount'],
+                marker={'size': 6 + 24 * np.sqrt(cell['PermitCount']
+                                                 / largest),
+                        'color': color,
+                        'opacity': 0.7},
+                hovertemplate=(label + ': ' + name
+                               + '<br>Permits: %{text}<extra></extra>')))
+
+    weights = bins['PermitCount'].sum()
+    center = ({'lon': (bins['Longitude'] * bins['PermitCount']).sum()
+               / weights,
+               'lat': (bins['Latitude'] * bins['PermitCount']).sum()
+               / weights}
+              if weights else None)
+    fig_map.update_layout(mapbox={'style': 'open-street-map',
+                                  'zoom': map_zoom,
+                                  'center': center},
+                          margin={'t': 60},
+                          height=map_height,
+                          width=map_width)
+    return fig_map
+
+
+# Sorted row positions of the permits in the selected zips and months, or
+# None for every row
+def permit_positions(data, slct_zip, months=None):
+    positions = None
+    if bool(slct_zip) is True:
+        positions = data.loc_zip_index.positions(slct_zip)
+    if months is not None:
+        in_months = data.date_index.positions(*months)
+        positions = (in_months if positions is None
+                     else np.intersect1d(positions, in_months,
+                                         assume_unique=True))
+    return positions
+
+
+# Permits of the selected zips and months inside bounds, at most
+# MAP_POINT_CAP of them
+def select_permits(data, slct_zip, bounds, months=None):
+    positions = permit_positions(data, slct_zip, months)
+
+    if bounds is not None:
+        in_view = data.permit_grid.query(bounds)
+        positions = (in_view if positions is None
+                     else np.intersect1d(positions, in_view,
+                                         assume_unique=True))
+    if positions is None:
+        positions = np.arange(len(data.df_has_loc))
+
+    return data.df_has_loc.take(cap_points(positions, MAP_POINT_CAP))
+
+
+# One marker per permit in df1
+def build_point_map(type_class, df1):
+    if LEAN_PAYLOAD:
+        return build_lean_point_map(type_class, df1)
 
     if type_class == 0:   # Color map by class
         fig_map = px.scatter_mapbox(
@@ -196,9 +810,9 @@ def update_map(type_class, slct_zip, pct_total):
                 color_discrete_map={"Single Family/Duplex": '#e9a3c9',
                                     'Multifamily': '#c51b7d',
                                     'Non-Residential': '#4d9221'},
-                zoom=10,
-                height=800,
-                width=700)
+                zoom=map_zoom,
+                height=map_height,
+                width=map_width)
     elif type_class == 1:   # Color map by type
         fig_map = px.scatter_mapbox(
                 df1,
@@ -220,21 +834,82 @@ def update_map(type_class, slct_zip, pct_total):
                 color_discrete_map={"New": '#2166ac',
                                     'Demolition': '#b2182b',
                                     'Addition/Alteration': '#67a9cf'},
-                zoom=10,
-                height=800,
-                width=700)
+                zoom=map_zoom,
+                height=map_height,
+                width=map_width)
 
     fig_map.update_traces(marker=dict(size=4))
-    fig_map.update_layout(showlegend=True,
-                          legend={'orientation': "h",
-                                  'yanchor': "bottom",
-                                  'y': 1.02,
-                                  'xanchor': "right",
-                                  'x': 1,
-                                  'title': '',
-                                  'itemsizing': 'constant',
-                                  'itemwidth': 30},
-                          paper_bgcolor=bg_color)
+    return fig_map
+
+
+# Same map as the px version, built from one go trace per (class, type)
+# pair. Class and type are constants in each trace's hovertemplate instead of
+# repeated per point, zips are sent as numbers and coordinates are rounded
+# to 5 decimals (about 1m). With MAP_LAZY_DETAILS each point only carries its
+# PermitNum and the detail panel fetches the rest.
+def build_lean_point_map(type_class, df1):
+    color_col = color_cols[type_class]
+    other_col = color_cols[1 - type_class]
+    colors = [class_colors, type_colors][type_class]
+    lon = np.round(df1['Longitude'].to_numpy(dtype=np.float64), 5)
+    lat = np.round(df1['Latitude'].to_numpy(dtype=np.float64), 5)
+    zips = pd.to_numeric(df1['OriginalZip'].astype(str)).to_numpy()
+    permit_nums = df1['PermitNum'].to_numpy()
+    groups = df1.groupby([color_col, other_col], observed=True).indices
+
+    fig_map = go.Figure()
+    for name, color in colors.items():
+        first = True
+        for (color_value, other_value), pos in groups.items():
+            if color_value != name:
+                continue
+            permit_class, permit_type = ((color_value, other_value)
+                                         if type_class == 0
+                                         else (other_value, color_value))
+            constant_hover = ('<br>Permit Type=' + permit_type
+                              + '<br>Permit Class=' + permit_class
+                              + '<extra></extra>')
+            if MAP_LAZY_DETAILS:
+                point_data = {'customdata': permit_nums[pos],
+                              'hovertemplate': constant_hover[4:]}
+            else:
+                point_data = {'customdata': zips[pos],
+                              'text': permit_nums[pos],
+                              'hovertemplate': ('Zip Code=%{customdata}'
+                                                '<br>Permit Number=%{text}'
+                                                + constant_hover)}
+            fig_map.add_trace(go.Scattermapbox(
+                    lon=lon[pos],
+                    lat=lat[pos],
+                    mode='markers',
+                    name=name,
+                    legendgroup=name,
+                    showlegend=first,
+                    marker={'size': 4, 'color': color},
+                    **point_data))
+            first = False
+
+    center = ({'lon': round(float(lon.mean()), 5),
+               'lat': round(float(lat.mean()), 5)} if len(df1) else None)
+    fig_map.update_layout(mapbox={'style': 'open-street-map',
+                                  'zoom': map_zoom,
+                                  'center': center},
+                          margin={'t': 60},
+                          height=map_height,
+                          width=map_width)
+    return fig_map
+
+
+def build_class_bar(data, slct_zip, pct_total, months=None):
+    with metrics.callback_seconds.time(callback='class_bars',
+                                       section='aggregate'):
+        if months is not None:
+            df4 = data.monthly_counts.range_cube(*months).zip_class_frame(
+                slct_zip)
+        else:
+            df4 = (data.permit_cube.zip_class_frame(slct_zip) if slct_zip
+                   else data.zip_class_g)
+    start = time.perf_counter()
 
 # ------------------CLASS BAR CHART___________________
 
@@ -265,7 +940,6 @@ def update_map(type_class, slct_zip, pct_total):
                                     'title': {'text': ''}})
 
         else:
-            df4 = df4[df4['OriginalZip'].isin(slct_zip)]
             fig_class = px.bar(df4, x="PermitClassCount", y="OriginalZip",
                                color='PermitClassMapRes', orientation='h',
                                labels={'PermitClassCount': 'Zip Class Total',
@@ -317,7 +991,6 @@ def update_map(type_class, slct_zip, pct_total):
                                     'tickformat': '%'})
 
         else:
-            df4 = df4[df4['OriginalZip'].isin(slct_zip)]
             fig_class = px.bar(df4, x="pct_permit_class", y="OriginalZip",
                                color='PermitClassMapRes', orientation='h',
                                labels={'PermitClassCount': 'Zip Class Total',
@@ -351,6 +1024,21 @@ def update_map(type_class, slct_zip, pct_total):
                                             },
                             paper_bgcolor=bg_color
                             )
+    metrics.callback_seconds.observe(time.perf_counter() - start,
+                                     callback='class_bars', section='figure')
+    return fig_class
+
+
+def build_type_bar(data, slct_zip, pct_total, months=None):
+    with metrics.callback_seconds.time(callback='type_bars',
+                                       section='aggregate'):
+        if months is not None:
+            df3 = data.monthly_counts.range_cube(*months).zip_type_frame(
+                slct_zip)
+        else:
+            df3 = (data.permit_cube.zip_type_frame(slct_zip) if slct_zip
+                   else data.zip_type_g)
+    start = time.perf_counter()
 
 # -----------------TYPE BAR CHART-------------------
 
@@ -378,7 +1066,6 @@ def update_map(type_class, slct_zip, pct_total):
                                    'title': {'text': ''}})
 
         else:
-            df3 = df3[df3['OriginalZip'].isin(slct_zip)]
             fig_type = px.bar(df3, x="PermitTypeCount", y="OriginalZip",
                               color='PermitTypeDesc', orientation='h',
                               labels={'PermitTypeDesc': 'Permit Type',
@@ -425,7 +1112,6 @@ def update_map(type_class, slct_zip, pct_total):
                                    'tickformat': '%'})
 
         else:
-            df3 = df3[df3['OriginalZip'].isin(slct_zip)]
             fig_type = px.bar(df3, x="pct_permit_type", y="OriginalZip",
                               color='PermitTypeDesc', orientation='h',
                               labels={'PermitTypeDesc': 'Permit Type',
@@ -457,8 +1143,17 @@ def update_map(type_class, slct_zip, pct_total):
                                     },
                            paper_bgcolor=bg_color
                            )
+    metrics.callback_seconds.observe(time.perf_counter() - start,
+                                     callback='type_bars', section='figure')
+    return fig_type
+
 
-    return (fig_map, fig_class, fig_type)
+# Warm-up runs last so it sees every builder defined. With PERMITS_SHARED
+# the defaults are rendered in the gunicorn master and inherited by workers.
+if WARMUP_TOP_N > 0:
+    warm_default_figures()
+if not PERMITS_SHARED:
+    start_background_tasks()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,246 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from check_payload_budget import (bars_request, figures_request,  # noqa: E402
+                                  map_request)
+from make_permits_csv import write_permits_csv  # noqa: E402
+
+# update_map inputs timed at every dataset size
+zip_selections = {'all zips': [],
+                  '1 zip': ['98103'],
+                  '3 zips': ['98103', '98115', '98117'],
+                  '10 zips': ['98101', '98103', '98105', '98107', '98109',
+                              '98112', '98115', '98117', '98119', '98122']}
+viewports = {'initial': None,
+             'city': {'bounds': [-122.44, 47.49, -122.23, 47.74],
+                      'zoom': 10},
+             'neighborhood': {'bounds': [-122.37, 47.59, -122.29, 47.64],
+                              'zoom': 13}}
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Uncached time to serve the figure requests in bodies one after another,
+# as a single sync worker would
+def time_requests(client, dashboard, bodies, repeat):
+    times = []
+    for _ in range(repeat):
+        dashboard.figure_cache.invalidate()
+        start = time.perf_counter()
+        responses = [client.post('/_dash-update-component', json=body)
+                     for body in bodies]
+        times.append(time.perf_counter() - start)
+    return responses, times
+
+
+# Runs inside a fresh interpreter: import the app against PERMITS_CSV and,
+# unless startup_only, time update_map for every input combination and the
+# figure requests of a page load through the Flask test client so
+# serialization and compression are included
+def measure(repeat, startup_only):
+    start = time.perf_counter()
+    import Seattle_Permits_Dashboard as dashboard
+    result = {'startup_s': time.perf_counter() - start,
+              'startup_peak_rss_mib': peak_rss_mib(),
+              'rows': len(dashboard.permit_data.df_has_loc)}
+    if startup_only:
+        return result
+
+    client = dashboard.server.test_client()
+    pooled = bool(dashboard.FIGURE_POOL)
+    result['update_map'] = []
+    for type_class in (0, 1):
+        for zip_label, slct_zip in zip_selections.items():
+            for view_label, viewport in viewports.items():
+                # With FIGURE_POOL the map comes from the combined callback
+                body = (figures_request(type_class, slct_zip, viewport,
+                                        changed='type_or_class.value')
+                        if pooled
+                        else map_request(type_class, slct_zip, viewport))
+                (response,), times = time_requests(client, dashboard, [body],
+                                                   repeat)
+                start = time.perf_counter()
+                client.post('/_dash-update-component', json=body)
+                cached_s = time.perf_counter() - start
+                encoded = client.post('/_dash-update-component', json=body,
+                                      headers={'Accept-Encoding': 'br'})
+                result['update_map'].append({
+                    'type_or_class': type_class,
+                    'slct_zip': zip_label,
+                    'viewport': view_label,
+                    'status': response.status_code,
+                    'median_ms': statistics.median(times) * 1e3,
+                    'min_ms': min(times) * 1e3,
+                    'repeat_ms': cached_s * 1e3,
+                    'bytes': len(response.data),
+                    'br_bytes': len(encoded.data)})
+
+    # Map plus both bar figures for a new zip selection: three requests, or
+    # one building them concurrently with FIGURE_POOL
+    result['page_load'] = []
+    for zip_label, slct_zip in zip_selections.items():
+        bodies = ([figures_request(0, slct_zip)] if pooled
+                  else [map_request(0, slct_zip),
+                        bars_request('class', slct_zip),
+                        bars_request('type', slct_zip)])
+        responses, times = time_requests(client, dashboard, bodies, repeat)
+        result['page_load'].append({
+            'slct_zip': zip_label,
+            'status': [response.status_code for response in responses],
+            'median_ms': statistics.median(times) * 1e3,
+            'min_ms': min(times) * 1e3})
+    result['peak_rss_mib'] = peak_rss_mib()
+    return result
+
+
+def run_child(csv_path, cache_dir, repeat, startup_only, figure_pool=''):
+    # No background refresh or warm-up renders competing with the timings
+    env = dict(os.environ, PERMITS_CSV=csv_path,
+               PERMITS_CACHE_DIR=cache_dir or '', PERMITS_REFRESH_SECONDS='0',
+               WARMUP_TOP_N='0', SELECTION_COUNTS_PATH='',
+               FIGURE_POOL=figure_pool)
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '--repeat', str(repeat)]
+    if startup_only:
+        command.append('--startup-only')
+    output = subprocess.run(command, env=env, cwd=repo_dir, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    # The app logs pipeline stats first; the result is the last line
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir,
+                              stdout=subprocess.PIPE, check=True,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Map latency keyed by input combination, for comparing two result files
+def _map_times(results):
+    return {(run['csv_rows'], entry['type_or_class'], entry['slct_zip'],
+             entry['viewport']): entry
+            for run in results['runs'] for entry in run.get('update_map', [])}
+
+
+def _page_load_times(results):
+    return {(run['csv_rows'], entry['slct_zip']): entry
+            for run in results['runs'] for entry in run.get('page_load', [])}
+
+
+def compare(baseline, results):
+    old_runs = {run['csv_rows']: run for run in baseline['runs']}
+    for run in results['runs']:
+        old = old_runs.get(run['csv_rows'])
+        if old is None:
+            continue
+        for metric in ('csv_startup_s', 'cache_startup_s', 'peak_rss_mib'):
+            if metric in old and metric in run:
+                print('{:>9} rows {:<16} {:>10.2f} -> {:>10.2f} ({:+.0%})'
+                      .format(run['csv_rows'], metric, old[metric],
+                              run[metric], run[metric] / old[metric] - 1))
+    old_times = _map_times(baseline)
+    for key, entry in _map_times(results).items():
+        if key in old_times:
+            old = old_times[key]
+            print('{:>9} rows map {} {:<9} {:<12} {:>8.1f} -> {:>8.1f} ms'
+                  ' {:>9} -> {:>9} bytes'.format(
+                      key[0], key[1], key[2], key[3], old['median_ms'],
+                      entry['median_ms'], old['bytes'], entry['bytes']))
+    old_loads = _page_load_times(baseline)
+    for key, entry in _page_load_times(results).items():
+        if key in old_loads:
+            print('{:>9} rows page load {:<9} {:>8.1f} -> {:>8.1f} ms'.format(
+                key[0], key[1], old_loads[key]['median_ms'],
+                entry['median_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time startup, memory and update_map on synthetic '
+                    'permit exports and write the results as JSON')
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='raw CSV sizes, up to 10000000')
+    parser.add_argument('--data-dir', default='bench_data',
+                        help='where generated CSVs and caches are kept')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline',
+                        help='earlier results file to compare against')
+    parser.add_argument('--figure-pool', choices=['threads', 'processes'],
+                        default='',
+                        help='run the app with FIGURE_POOL set to this')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--startup-only', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.repeat, args.startup_only)))
+        return
+
+    import pandas as pd  # pip install pandas==1.2.3
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {'commit': git_commit(),
+               'date': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'pandas': pd.__version__,
+               'machine': platform.machine(),
+               'figure_pool': args.figure_pool or None,
+               'runs': []}
+    for rows in args.rows:
+        csv_path = os.path.abspath(
+            os.path.join(args.data_dir, 'permits_{}.csv'.format(rows)))
+        if not os.path.exists(csv_path):
+            print('generating {} rows'.format(rows))
+            write_permits_csv(csv_path, rows)
+        cache_dir = csv_path[:-len('.csv')] + '_cache'
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+        # Startup straight from the CSV, then from a warm feather cache
+        csv_run = run_child(csv_path, None, args.repeat, True)
+        run_child(csv_path, cache_dir, args.repeat, True)   # fills the cache
+        run = run_child(csv_path, cache_dir, args.repeat, False,
+                        args.figure_pool)
+        run.update(csv_rows=rows, csv_startup_s=csv_run['startup_s'],
+                   csv_startup_peak_rss_mib=csv_run['startup_peak_rss_mib'],
+                   cache_startup_s=run.pop('startup_s'))
+        results['runs'].append(run)
+        slowest = max(run['update_map'], key=lambda e: e['median_ms'])
+        print('{} rows: startup {:.1f}s from csv, {:.1f}s from cache; peak '
+              '{:.0f} MiB; slowest map {:.0f} ms ({} / {}); all-zips page '
+              'load {:.0f} ms'.format(
+                  rows, run['csv_startup_s'], run['cache_startup_s'],
+                  run['peak_rss_mib'], slowest['median_ms'],
+                  slowest['slct_zip'], slowest['viewport'],
+                  run['page_load'][0]['median_ms']))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('wrote ' + args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np  # pip install numpy==1.21.1
+import pandas as pd  # pip install pandas==1.2.3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zip_index import ZipIndex  # noqa: E402
+
+seattle_zips = ['98101', '98102', '98103', '98104', '98105', '98106',
+                '98107', '98108', '98109', '98112', '98115', '98116',
+                '98117', '98118', '98119', '98121', '98122', '98125',
+                '98126', '98133', '98134', '98136', '98144', '98146',
+                '98177', '98178', '98195', '98199']
+
+
+# Zip-sorted frame shaped like df_has_loc's filter columns
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'OriginalZip': pd.Categorical(rng.choice(seattle_zips, rows)),
+        'Latitude': rng.normal(47.6, 0.06, rows).astype('float32'),
+        'Longitude': rng.normal(-122.33, 0.05, rows).astype('float32')})
+    return df.sort_values('OriginalZip', kind='mergesort', ignore_index=True)
+
+
+def best_of(stmt, repeat, number=5):
+    return min(timeit.repeat(stmt, repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare isin zip filtering against ZipIndex slices')
+    parser.add_argument('--rows', type=int, default=15000,
+                        help='row count of the 1x frame')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    selections = {'1 zip': seattle_zips[:1],
+                  '3 zips': seattle_zips[:3],
+                  '10 zips': seattle_zips[::3]}
+    print('{:>5} {:>10} {:>8} {:>12} {:>12} {:>8}'.format(
+        'scale', 'rows', 'select', 'isin ms', 'index ms', 'speedup'))
+    for scale in (1, 10, 100):
+        df = make_frame(args.rows * scale)
+        index = ZipIndex(df)
+        for label, slct_zip in selections.items():
+            isin_s = best_of(
+                lambda: df[df['OriginalZip'].isin(slct_zip)], args.repeat)
+            index_s = best_of(
+                lambda: index.select(df, slct_zip), args.repeat)
+            print('{:>4}x {:>10} {:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(
+                scale, len(df), label, isin_s * 1e3, index_s * 1e3,
+                isin_s / index_s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Body of the _dash-update-component request the browser sends for the map
+def map_request(type_class, slct_zip=(), viewport=None):
+    return {'output': 'sea_permit_map.figure',
+            'outputs': {'id': 'sea_permit_map', 'property': 'figure'},
+            'inputs': [{'id': 'type_or_class', 'property': 'value',
+                        'value': type_class},
+                       {'id': 'slct_zip', 'property': 'value',
+                        'value': list(slct_zip)},
+                       {'id': 'map_viewport', 'property': 'data',
+                        'value': viewport},
+                       {'id': 'month_range', 'property': 'value',
+                        'value': None}],
+            'changedPropIds': ['type_or_class.value'],
+            'state': []}
+
+
+# Body of the request for one bar figure store ('class' or 'type')
+def bars_request(bars, slct_zip=()):
+    return {'output': bars + '_bar_figures.data',
+            'outputs': {'id': bars + '_bar_figures', 'property': 'data'},
+            'inputs': [{'id': 'slct_zip', 'property': 'value',
+                        'value': list(slct_zip)},
+                       {'id': 'month_range', 'property': 'value',
+                        'value': None}],
+            'changedPropIds': ['slct_zip.value'],
+            'state': []}
+
+
+# Body of the request for all three figures when FIGURE_POOL is set. With
+# changed='type_or_class.value' only the map is rebuilt.
+def figures_request(type_class, slct_zip=(), viewport=None,
+                    changed='slct_zip.value'):
+    outputs = [{'id': 'sea_permit_map', 'property': 'figure'},
+               {'id': 'class_bar_figures', 'property': 'data'},
+               {'id': 'type_bar_figures', 'property': 'data'}]
+    body = map_request(type_class, slct_zip, viewport)
+    body.update(output='..' + '...'.join('{id}.{property}'.format(**output)
+                                         for output in outputs) + '..',
+                outputs=outputs, changedPropIds=[changed])
+    return body
+
+
+# Whole-city view at the first zoom drawn as points, so the point map holds
+# up to MAP_POINT_CAP permits: its largest response
+city_bounds = [-122.46, 47.48, -122.22, 47.74]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fail (exit status 1) if a compressed all-zips map '
+                    'response exceeds its byte budget: the binned map of '
+                    'the initial view and the point map at the zoom it '
+                    'starts at')
+    parser.add_argument('--bins-budget-kb', type=float, default=50,
+                        help='budget for the binned map')
+    parser.add_argument('--points-budget-kb', type=float, default=300,
+                        help='budget for the point map (MAP_POINT_CAP '
+                             'points at most)')
+    parser.add_argument('--encoding', default='br',
+                        help='Accept-Encoding sent with the request')
+    args = parser.parse_args()
+
+    import Seattle_Permits_Dashboard as dashboard
+
+    checks = [('points', {'bounds': city_bounds,
+                          'zoom': dashboard.MAP_BIN_ZOOM},
+               args.points_budget_kb)]
+    if dashboard.MAP_BIN_ZOOM > dashboard.map_zoom:
+        checks.insert(0, ('bins', None, args.bins_budget_kb))
+
+    client = dashboard.server.test_client()
+    failed = []
+    for mode, viewport, budget_kb in checks:
+        for type_class in (0, 1):
+            body = (figures_request(type_class, viewport=viewport,
+                                    changed='type_or_class.value')
+                    if dashboard.FIGURE_POOL
+                    else map_request(type_class, viewport=viewport))
+            response = client.post('/_dash-update-component', json=body,
+                                   headers={'Accept-Encoding': args.encoding})
+            size_kb = len(response.data) / 1024
+            ok = response.status_code == 200 and size_kb <= budget_kb
+            if not ok:
+                failed.append('{} type_or_class={}'.format(mode, type_class))
+            print('{:<6} type_or_class={} status={} encoding={} {:.1f} KiB'
+                  ' (budget {:.0f} KiB) {}'.format(
+                      mode, type_class, response.status_code,
+                      response.headers.get('Content-Encoding', 'identity'),
+                      size_kb, budget_kb, 'ok' if ok else 'OVER'))
+    if failed:
+        print('payload budget exceeded: ' + ', '.join(failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
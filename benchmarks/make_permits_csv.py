@@ -0,0 +1,131 @@
+import argparse
+
+import numpy as np  # pip install numpy==1.21.1
+import pandas as pd  # pip install pandas==1.2.3
+
+# Approximate centroid (lat, lon) and relative permit volume per zip
+zip_centroids = {'98101': (47.611, -122.333, 3),
+                 '98102': (47.635, -122.322, 4),
+                 '98103': (47.673, -122.342, 10),
+                 '98104': (47.603, -122.327, 2),
+                 '98105': (47.663, -122.300, 5),
+                 '98106': (47.534, -122.355, 5),
+                 '98107': (47.668, -122.377, 6),
+                 '98108': (47.542, -122.310, 4),
+                 '98109': (47.632, -122.347, 4),
+                 '98112': (47.630, -122.297, 5),
+                 '98115': (47.685, -122.302, 9),
+                 '98116': (47.574, -122.396, 6),
+                 '98117': (47.689, -122.379, 9),
+                 '98118': (47.541, -122.277, 8),
+                 '98119': (47.640, -122.369, 5),
+                 '98121': (47.615, -122.345, 2),
+                 '98122': (47.611, -122.305, 7),
+                 '98125': (47.717, -122.300, 6),
+                 '98126': (47.548, -122.372, 6),
+                 '98133': (47.738, -122.344, 6),
+                 '98134': (47.580, -122.334, 1),
+                 '98136': (47.538, -122.390, 4),
+                 '98144': (47.585, -122.300, 7),
+                 '98146': (47.500, -122.357, 2),
+                 '98177': (47.742, -122.371, 3),
+                 '98178': (47.499, -122.248, 3),
+                 '98195': (47.655, -122.308, 1),
+                 '98199': (47.648, -122.397, 5)}
+
+# Value weights for the columns the pipeline filters on
+status_weights = {'Completed': 30, 'Closed': 8, 'Expired': 8, 'Canceled': 6,
+                  'Withdrawn': 3, 'Issued': 20, 'Application Completed': 8,
+                  'Reviews In Process': 8, 'Awaiting Information': 3,
+                  'Corrections Required': 3, 'Ready for Issuance': 2,
+                  'Phase Issued': 1}
+class_weights = {'Single Family/Duplex': 50, 'Multifamily': 20,
+                 'Commercial': 20, 'Institutional': 3, 'Industrial': 3,
+                 'Vacant Land': 3}
+type_weights = {'Addition/Alteration': 45, 'New': 20, 'Demolition': 8,
+                'Tenant Improvement': 15, 'Temporary': 4,
+                'Deconstruction': 3, 'Curb Cut': 5}
+descriptions = ['Construct addition to existing single family residence, '
+                'per plan.',
+                'Demolish existing structure.',
+                'Construct new townhouse, per plan.',
+                'Tenant improvement to existing office space, per plan.',
+                'Alterations to existing apartment building, per plan.']
+streets = ['2ND AVE', 'PINE ST', 'NE 65TH ST', 'RAINIER AVE S',
+           'CALIFORNIA AVE SW', 'AURORA AVE N', 'N 45TH ST', 'E UNION ST']
+
+# Share of rows left null, per column, roughly as in the city export
+null_rates = {'PermitClass': 0.01, 'Description': 0.05,
+              'HousingUnitsRemoved': 0.5, 'HousingUnitsAdded': 0.5,
+              'EstProjectCost': 0.3, 'OriginalZip': 0.02, 'Latitude': 0.03,
+              'Longitude': 0.03, 'IssuedDate': 0.2, 'OriginalAddress1': 0.01}
+
+
+def _choice(rng, weights, rows):
+    values = list(weights)
+    p = np.array(list(weights.values()), dtype=float)
+    return rng.choice(values, rows, p=p / p.sum())
+
+
+# One chunk of synthetic rows in the Building_Permit_Map.csv layout,
+# permit numbers starting at first_id
+def make_permits(rows, first_id=0, seed=0):
+    rng = np.random.default_rng(seed)
+    zips = _choice(rng, {z: w for z, (_, _, w) in zip_centroids.items()},
+                   rows)
+    lat0, lon0 = np.array([zip_centroids[z][:2] for z in zips]).T
+    permit_class = _choice(rng, class_weights, rows)
+    permit_type = _choice(rng, type_weights, rows)
+    applied = (np.datetime64('2005-01-01')
+               + rng.integers(0, 365 * 17, rows).astype('timedelta64[D]'))
+    issued = applied + rng.integers(0, 400, rows).astype('timedelta64[D]')
+    df = pd.DataFrame({
+        'PermitNum': ['{}-CN'.format(6000000 + i)
+                      for i in range(first_id, first_id + rows)],
+        'PermitClass': permit_class,
+        'PermitClassMapped': np.where(
+            np.isin(permit_class, ['Single Family/Duplex', 'Multifamily']),
+            'Residential', 'Non-Residential'),
+        'PermitTypeMapped': 'Building',
+        'PermitTypeDesc': permit_type,
+        'Description': rng.choice(descriptions, rows),
+        'HousingUnits': rng.integers(0, 4, rows).astype(float),
+        'HousingUnitsRemoved': rng.integers(0, 2, rows).astype(float),
+        'HousingUnitsAdded': rng.integers(0, 4, rows).astype(float),
+        'EstProjectCost': np.round(rng.lognormal(11, 1.5, rows)),
+        'AppliedDate': pd.to_datetime(applied).strftime('%Y-%m-%d'),
+        'StatusCurrent': _choice(rng, status_weights, rows),
+        'OriginalZip': zips.astype(float),
+        'Latitude': lat0 + rng.normal(0, 0.008, rows),
+        'Longitude': lon0 + rng.normal(0, 0.010, rows),
+        'IssuedDate': pd.to_datetime(issued).strftime('%Y-%m-%d'),
+        'OriginalAddress1': ['{} {}'.format(number, street) for number, street
+                             in zip(rng.integers(100, 9999, rows),
+                                    rng.choice(streets, rows))]})
+    for col, rate in null_rates.items():
+        df.loc[rng.random(rows) < rate, col] = np.nan
+    return df
+
+
+# Write rows synthetic permits to path, chunk_rows at a time so 10M-row
+# files do not need 10M rows in memory
+def write_permits_csv(path, rows, seed=0, chunk_rows=500000):
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        chunk = make_permits(min(chunk_rows, rows - start), first_id=start,
+                             seed=[seed, i])
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0,
+                     index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic Building_Permit_Map.csv')
+    parser.add_argument('rows', type=int, help='e.g. 10000 to 10000000')
+    parser.add_argument('path', nargs='?', default='Building_Permit_Map.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_permits_csv(args.path, args.rows, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
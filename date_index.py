@@ -0,0 +1,20 @@
+import numpy as np  # pip install numpy==1.21.1
+
+
+# Row positions ordered by date, so the rows inside a date range are one
+# searchsorted slice instead of a comparison over every row. Rows without a
+# date (-1) are never returned.
+class DateIndex:
+
+    def __init__(self, months):
+        months = np.asarray(months)
+        dated = np.flatnonzero(months >= 0)
+        order = np.argsort(months[dated], kind='stable')
+        self.size = len(months)
+        self.order = dated[order]
+        self.sorted_months = months[self.order]
+
+    # Sorted row positions dated in months [start, stop)
+    def positions(self, start, stop):
+        a, b = np.searchsorted(self.sorted_months, [start, stop])
+        return np.sort(self.order[a:b])
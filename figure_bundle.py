@@ -0,0 +1,82 @@
+import gzip
+import json
+import os
+
+import plotly.io as pio  # pip install plotly==5.1.0
+from plotly.utils import PlotlyJSONEncoder
+
+manifest_name = 'manifest.json'
+
+# Bar figures hold the percent and total charts, in that order
+bar_modes = ['percent', 'total']
+
+
+# File stem for a FigureCache key: figure name, options (unset ones left
+# out, month ranges as start_stop), then the zip or 'all'. Only all-zips and
+# single-zip keys are bundled.
+def artifact_name(key):
+    zips = sorted(key[-1])
+    parts = [key[0]] + ['_'.join(map(str, option))
+                        if isinstance(option, tuple) else str(option)
+                        for option in key[1:-1] if option is not None]
+    parts.append(zips[0] if zips else 'all')
+    return '-'.join(parts)
+
+
+def write_artifacts(bundle_dir, key, figure):
+    name = artifact_name(key)
+    with gzip.open(os.path.join(bundle_dir, name + '.json.gz'), 'wt') as f:
+        json.dump(figure, f, cls=PlotlyJSONEncoder)
+    if isinstance(figure, list):
+        pages = [('{}-{}'.format(name, mode), fig)
+                 for mode, fig in zip(bar_modes, figure)]
+    else:
+        pages = [(name, figure)]
+    for page_name, fig in pages:
+        pio.write_html(fig, os.path.join(bundle_dir, page_name + '.html'),
+                       include_plotlyjs='cdn')
+
+
+def write_manifest(bundle_dir, source, settings, keys):
+    manifest = {'source': source, 'settings': settings,
+                'figures': sorted(artifact_name(key) for key in keys)}
+    tmp_path = os.path.join(bundle_dir, manifest_name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(bundle_dir, manifest_name))
+
+
+# Figures pre-rendered by prerender.py, read back as the plain dicts the
+# callbacks return. A bundle only applies to the CSV content (sha256) and
+# figure settings it was rendered with.
+class FigureBundle:
+
+    def __init__(self, bundle_dir, names):
+        self.bundle_dir = bundle_dir
+        self.names = set(names)
+
+    @classmethod
+    def open(cls, bundle_dir, sha256, settings):
+        try:
+            with open(os.path.join(bundle_dir, manifest_name)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (manifest['source'].get('sha256') != sha256
+                or manifest['settings'] != settings):
+            return None
+        return cls(bundle_dir, manifest['figures'])
+
+    # Figure for a FigureCache key, or None if it was not pre-rendered
+    def get(self, key):
+        if len(key[-1]) > 1:
+            return None
+        name = artifact_name(key)
+        if name not in self.names:
+            return None
+        try:
+            with gzip.open(os.path.join(self.bundle_dir, name + '.json.gz'),
+                           'rt') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+
+
+# Size-bounded LRU of rendered figures keyed on the normalized callback
+# inputs. Entries are tagged with a data version so figures rendered from
+# data that has since been reloaded are never stored or served.
+class FigureCache:
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # figure names what is cached and options are the other inputs it
+    # depends on; zip order in the dropdown does not change the figures
+    @staticmethod
+    def make_key(figure, slct_zip, *options):
+        return (figure,) + options + (frozenset(slct_zip or ()),)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # version is the cache version read before the figures were rendered
+    def put(self, key, value, version):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Call whenever the underlying frames are reloaded
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.version += 1
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses,
+                    'version': self.version}
@@ -0,0 +1,20 @@
+import gc
+import os
+
+# Shared-data mode: import the app once in the master so the permit data and
+# its indexes are built before forking and the workers share those pages
+preload_app = os.environ.get('PERMITS_SHARED', '0') == '1'
+
+
+def when_ready(server):
+    if preload_app:
+        # Move the master's objects out of the collector's reach so workers
+        # do not copy their pages just by running a collection
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import Seattle_Permits_Dashboard
+        Seattle_Permits_Dashboard.start_background_tasks()
@@ -0,0 +1,114 @@
+import numpy as np  # pip install numpy==1.21.1
+import pandas as pd  # pip install pandas==1.2.3
+
+from permit_cube import dims, sorted_codes
+
+# Map colour column per type_or_class slider value
+color_cols = ['PermitClassMapRes', 'PermitTypeDesc']
+
+
+# Degrees of longitude one pixel spans at a mapbox zoom level (512px tiles)
+def degrees_per_pixel(zoom):
+    return 360 / (512 * 2 ** zoom)
+
+
+# Permit counts binned into square grid cells for a few zoom levels, so the
+# zoomed-out map draws one marker per (cell, class or type) instead of one
+# per permit. Cells are cell_px pixels wide at their zoom level.
+class PermitBins:
+
+    def __init__(self, df_has_loc, levels, cell_px=24):
+        self.levels = sorted(levels)
+        lon = df_has_loc['Longitude'].to_numpy(dtype=np.float64)
+        lat = df_has_loc['Latitude'].to_numpy(dtype=np.float64)
+        codes, labels = zip(*(sorted_codes(df_has_loc[dim]) for dim in dims))
+        self.zips = labels[0]
+        # Category codes and labels indexed by type_class: 0 class, 1 type
+        self.labels = [labels[2], labels[1]]
+        self._zip_pos = {zip_code: i for i, zip_code in enumerate(self.zips)}
+        lon0 = lon.min() if len(lon) else 0.0
+        lat0 = lat.min() if len(lat) else 0.0
+        # Per-row values kept for binning arbitrary row subsets (date ranges)
+        self._rows = {'category': [codes[2], codes[1]], 'lon': lon,
+                      'lat': lat, 'cell': {}}
+
+        self._tables = {}
+        self._all_zips = {}
+        for level in self.levels:
+            cell_deg = cell_px * degrees_per_pixel(level)
+            ix = ((lon - lon0) // cell_deg).astype(np.int64)
+            iy = ((lat - lat0) // cell_deg).astype(np.int64)
+            nx = int(ix.max()) + 1 if len(ix) else 1
+            cells = iy * nx + ix
+            self._rows['cell'][level] = cells
+            shape = ((int(cells.max()) + 1 if len(cells) else 1,)
+                     + tuple(len(label) for label in labels))
+            keys, inverse = np.unique(
+                np.ravel_multi_index((cells,) + codes, shape),
+                return_inverse=True)
+            cell, zip_code, type_code, class_code = np.unravel_index(keys,
+                                                                     shape)
+            self._tables[level] = {
+                'cell': cell,
+                'zip': zip_code,
+                'category': [class_code, type_code],
+                'count': np.bincount(inverse),
+                'lon': np.bincount(inverse, weights=lon),
+                'lat': np.bincount(inverse, weights=lat)}
+            for type_class in (0, 1):
+                self._all_zips[level, type_class] = self._aggregate(
+                    self._tables[level], type_class)
+
+    # Collapse a level's (cell, zip, type, class) table, or per-row values,
+    # to (cell, category)
+    def _aggregate(self, table, type_class, mask=None, cell=None):
+        category = table['category'][type_class]
+        cell = table['cell'] if cell is None else cell
+        count, lon, lat = (table.get('count'), table['lon'], table['lat'])
+        if mask is not None:
+            category, cell, lon, lat = (category[mask], cell[mask], lon[mask],
+                                        lat[mask])
+            count = None if count is None else count[mask]
+        n_categories = len(self.labels[type_class])
+        keys, inverse = np.unique(cell * n_categories + category,
+                                  return_inverse=True)
+        counts = np.bincount(inverse, weights=count)
+        return pd.DataFrame({
+            color_cols[type_class]: self.labels[type_class][keys
+                                                            % n_categories],
+            'PermitCount': counts.astype(np.int64),
+            'Longitude': np.bincount(inverse, weights=lon) / counts,
+            'Latitude': np.bincount(inverse, weights=lat) / counts})
+
+    @staticmethod
+    def _in_bounds(frame, bounds):
+        if bounds is None:
+            return frame
+        west, south, east, north = bounds
+        return frame[frame['Longitude'].between(west, east)
+                     & frame['Latitude'].between(south, north)]
+
+    def level_for(self, zoom):
+        return min(max(int(zoom), self.levels[0]), self.levels[-1])
+
+    # Bins at the level nearest zoom for the selected zips, optionally
+    # limited to centroids inside bounds (west, south, east, north)
+    def bins(self, zoom, type_class, slct_zip=None, bounds=None):
+        level = self.level_for(zoom)
+        if not slct_zip:
+            frame = self._all_zips[level, type_class]
+        else:
+            table = self._tables[level]
+            zip_codes = [self._zip_pos[zip_code] for zip_code in slct_zip
+                         if zip_code in self._zip_pos]
+            frame = self._aggregate(table, type_class,
+                                    np.isin(table['zip'], zip_codes))
+        return self._in_bounds(frame, bounds)
+
+    # Bins at the level nearest zoom for the permits at row positions, for
+    # filters the precomputed tables do not cover (a date range)
+    def bins_for_rows(self, zoom, type_class, positions, bounds=None):
+        level = self.level_for(zoom)
+        frame = self._aggregate(self._rows, type_class, positions,
+                                self._rows['cell'][level])
+        return self._in_bounds(frame, bounds)
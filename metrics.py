@@ -0,0 +1,151 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Every metric created below, in the order /metrics lists them
+registry = []
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for name, value in pairs) + '}'
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+# Minimal in-process metrics rendered in the Prometheus text format. Each
+# gunicorn worker keeps its own values, so a scrape reports one worker.
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    # Adds the seconds spent in the with-block
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets) + [float('inf')]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    # Observes the seconds spent in the with-block
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', key,
+                                    (('le', _number(bound)),), cumulative))
+                samples.append((self.name + '_sum', key, (), total))
+                samples.append((self.name + '_count', key, (), cumulative))
+        return samples
+
+
+# A process forked while another thread holds a metric's lock (the render
+# processes of FIGURE_POOL=processes) would otherwise inherit it locked
+def _reset_locks():
+    for metric in registry:
+        metric._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks)
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for name, key, extra, value in metric.samples():
+            lines.append('{}{} {}'.format(
+                name, _label_text(metric.labelnames, key, extra),
+                _number(value)))
+    return '\n'.join(lines) + '\n'
+
+
+# Startup and reload work: CSV parsing, cleaning, cube and index builds
+pipeline_seconds = Counter(
+    'permits_pipeline_seconds_total',
+    'Seconds spent in each data pipeline stage, summed over chunks and '
+    'reloads', ['stage'])
+
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+callback_seconds = Histogram(
+    'dashboard_callback_section_seconds',
+    'Seconds spent in each section of a dashboard callback',
+    ['callback', 'section'], latency_buckets)
+
+request_seconds = Histogram(
+    'dashboard_request_seconds',
+    'Callback request time including Dash serialization, per output',
+    ['output'], latency_buckets)
+
+response_bytes = Histogram(
+    'dashboard_response_bytes',
+    'Uncompressed callback response size, per output',
+    ['output'], [1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6])
+
+selected_zips = Histogram(
+    'dashboard_selected_zips',
+    'Zip codes selected per callback call',
+    ['callback'], [0, 1, 2, 5, 10, 20, 40])
+
+map_points = Histogram(
+    'dashboard_map_markers',
+    'Markers drawn per map figure: permits in point mode, cells when binned',
+    ['mode'], [10, 100, 1e3, 5e3, 1e4, 2.5e4, 5e4, 1e5])
@@ -0,0 +1,128 @@
+import argparse
+import hashlib
+import json
+import os
+
+import pyarrow.feather as feather  # pip install pyarrow==5.0.0
+
+import permit_pipeline
+from metrics import pipeline_seconds
+
+# Bump when the pipeline output changes shape so stale caches get rebuilt
+cache_version = 6
+frame_names = ['df_has_loc', 'permit_counts']
+manifest_name = 'manifest.json'
+
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, manifest_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Size and mtime are checked first; the hash is only recomputed when they
+# differ, so a touched but unchanged CSV does not force a rebuild
+def is_fresh(csv_path, manifest):
+    if manifest is None or manifest.get('version') != cache_version:
+        return False
+    stat = source_stat(csv_path)
+    if stat['size'] != manifest['size']:
+        return False
+    if stat['mtime_ns'] == manifest['mtime_ns']:
+        return True
+    return file_hash(csv_path) == manifest['sha256']
+
+
+def _atomic_write(path, write):
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# Fingerprint of the CSV the frames were built from
+def source_key(csv_path):
+    return dict(source_stat(csv_path), sha256=file_hash(csv_path))
+
+
+def write_cache(frames, csv_path, cache_dir, key=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    key = key or source_key(csv_path)
+    for name in frame_names:
+        frame = frames[name].reset_index(drop=True)
+        _atomic_write(os.path.join(cache_dir, name + '.feather'),
+                      lambda p: feather.write_feather(
+                          frame, p, compression='uncompressed'))
+
+    # Manifest goes last so readers never see it ahead of the frames
+    manifest = dict(key, version=cache_version,
+                    source=os.path.abspath(csv_path))
+
+    def write_manifest(p):
+        with open(p, 'w') as f:
+            json.dump(manifest, f)
+    _atomic_write(os.path.join(cache_dir, manifest_name), write_manifest)
+
+
+# With memory_map, split_blocks leaves the numeric and category code columns
+# as read-only views of the mapped file, so every process reading the same
+# cache shares those pages through the OS page cache
+def read_cache(cache_dir, memory_map=False):
+    return {name: (feather.read_table(os.path.join(cache_dir,
+                                                   name + '.feather'),
+                                      memory_map=memory_map)
+                   .to_pandas(split_blocks=memory_map))
+            for name in frame_names}
+
+
+# Load the cleaned frames from cache_dir, rebuilding them from the CSV only
+# when the source has changed since the cache was written. Returns the frames
+# and the source key they were built from: the manifest validated before
+# reading (write_cache replaces it last, so the frames are never older) or
+# the key taken before a rebuild. Callers must not re-read the manifest
+# later, as another process may have rewritten it for a newer CSV.
+def load_frames(csv_path, cache_dir, memory_map=False, force=False):
+    manifest = read_manifest(cache_dir)
+    if not force and is_fresh(csv_path, manifest):
+        try:
+            with pipeline_seconds.time(stage='cache_read'):
+                return read_cache(cache_dir, memory_map=memory_map), manifest
+        except OSError:
+            pass  # partially written or removed cache, rebuild below
+
+    # Key the source before reading it so an export replaced mid-build is
+    # picked up on the next start instead of being masked by the cache
+    key = source_key(csv_path)
+    frames = permit_pipeline.build_frames(csv_path)
+    with pipeline_seconds.time(stage='cache_write'):
+        write_cache(frames, csv_path, cache_dir, key=key)
+    if memory_map:
+        # Serve the mapped copy so the built frames can be freed
+        return read_cache(cache_dir, memory_map=True), key
+    return frames, key
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the columnar permit cache ahead of app startup')
+    parser.add_argument('csv_path', nargs='?',
+                        default='Building_Permit_Map.csv')
+    parser.add_argument('cache_dir', nargs='?', default='permit_cache')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild even if the cache is fresh')
+    args = parser.parse_args()
+    load_frames(args.csv_path, args.cache_dir, force=args.force)
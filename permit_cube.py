@@ -0,0 +1,156 @@
+import numpy as np  # pip install numpy==1.21.1
+import pandas as pd  # pip install pandas==1.2.3
+
+dims = ['OriginalZip', 'PermitTypeDesc', 'PermitClassMapRes']
+
+
+# Integer codes for a column plus its labels, with labels sorted so that
+# axis order matches what a sorted groupby would produce
+def sorted_codes(series):
+    cat = series.astype('category')
+    if not cat.cat.categories.is_monotonic_increasing:
+        cat = cat.cat.reorder_categories(cat.cat.categories.sort_values())
+    return (cat.cat.codes.to_numpy().astype(np.intp),
+            cat.cat.categories.to_numpy(dtype=object))
+
+
+# Dense permit counts indexed by (zip, PermitTypeDesc, PermitClassMapRes).
+# Every per-zip count, total and percent the charts use is an axis sum of
+# this tensor, for all zips or any subset of them.
+class PermitCube:
+
+    def __init__(self, counts, zips, types, classes):
+        self.counts = counts
+        self.zips = zips
+        self.types = types
+        self.classes = classes
+        self._zip_pos = {zip_code: i for i, zip_code in enumerate(zips)}
+
+    # Single bincount pass over the cleaned permit rows
+    @classmethod
+    def from_permits(cls, df_has_loc):
+        codes, labels = zip(*(sorted_codes(df_has_loc[dim]) for dim in dims))
+        shape = tuple(len(label) for label in labels)
+        flat = np.ravel_multi_index(codes, shape)
+        counts = np.bincount(flat, minlength=int(np.prod(shape)))
+        return cls(counts.reshape(shape).astype(np.int64), *labels)
+
+    # Rebuild from the long form written by to_counts
+    @classmethod
+    def from_counts(cls, permit_counts):
+        codes, labels = zip(*(sorted_codes(permit_counts[dim])
+                              for dim in dims))
+        shape = tuple(len(label) for label in labels)
+        counts = np.zeros(shape, dtype=np.int64)
+        counts[codes] = permit_counts['PermitCount'].to_numpy()
+        return cls(counts, *labels)
+
+    # Non-zero cells as a long frame, compact enough to cache
+    def to_counts(self):
+        z, t, c = np.nonzero(self.counts)
+        return pd.DataFrame({'OriginalZip': self.zips[z],
+                             'PermitTypeDesc': self.types[t],
+                             'PermitClassMapRes': self.classes[c],
+                             'PermitCount': self.counts[z, t, c]})
+
+    # Sub-tensor and zip labels for the selected zips, all zips by default
+    def select(self, slct_zip=None):
+        if not slct_zip:
+            return self.counts, self.zips
+        pos = sorted(self._zip_pos[zip_code] for zip_code in set(slct_zip)
+                     if zip_code in self._zip_pos)
+        return self.counts[pos], self.zips[pos]
+
+    @staticmethod
+    def _zip_frame(counts, zips, labels, label_col, count_col, total_col,
+                   pct_col):
+        totals = counts.sum(axis=1)
+        z, k = np.nonzero(counts)
+        return pd.DataFrame({'OriginalZip': zips[z],
+                             label_col: labels[k],
+                             count_col: counts[z, k],
+                             total_col: totals[z],
+                             pct_col: np.round(counts[z, k] / totals[z], 4)})
+
+    # Same shape as the old zip_type_g groupby/merge chain
+    def zip_type_frame(self, slct_zip=None):
+        counts, zips = self.select(slct_zip)
+        return self._zip_frame(counts.sum(axis=2), zips, self.types,
+                               'PermitTypeDesc', 'PermitTypeCount',
+                               'TotalTypePermit', 'pct_permit_type')
+
+    # Same shape as the old zip_class_g groupby/merge chain
+    def zip_class_frame(self, slct_zip=None):
+        counts, zips = self.select(slct_zip)
+        return self._zip_frame(counts.sum(axis=1), zips, self.classes,
+                               'PermitClassMapRes', 'PermitClassCount',
+                               'TotalClassPermit', 'pct_permit_class')
+
+    # Same shape as the old type_grouper groupby
+    def type_class_frame(self, slct_zip=None):
+        counts, zips = self.select(slct_zip)
+        z, t, c = np.nonzero(counts)
+        return pd.DataFrame({'OriginalZip': zips[z],
+                             'PermitTypeDesc': self.types[t],
+                             'PermitClass': self.classes[c],
+                             'PermitTypeCount': counts[z, t, c]})
+
+    # Type x class counts summed over the selected zips, for cross filters
+    def type_class_totals(self, slct_zip=None):
+        counts, _ = self.select(slct_zip)
+        return pd.DataFrame(counts.sum(axis=0), index=self.types,
+                            columns=self.classes)
+
+
+# Month number of each date (months since 1970-01, -1 where null), the unit
+# of the date range control
+def month_numbers(dates):
+    values = pd.to_datetime(dates).to_numpy(dtype='datetime64[ns]')
+    months = values.astype('datetime64[M]').astype(np.int64)
+    return np.where(np.isnat(values), -1, months)
+
+
+# Per-(zip, type, class, month) permit counts held as prefix sums over the
+# month axis, so the cube for any month range is one subtraction whatever
+# the row count. Permits without a date are left out of every range.
+class MonthlyCounts:
+
+    def __init__(self, cumulative, first_month, zips, types, classes):
+        self.cumulative = cumulative
+        self.first_month = first_month
+        self.zips = zips
+        self.types = types
+        self.classes = classes
+
+    @classmethod
+    def from_permits(cls, df_has_loc, date_col):
+        codes, labels = zip(*(sorted_codes(df_has_loc[dim]) for dim in dims))
+        months = month_numbers(df_has_loc[date_col])
+        dated = months >= 0
+        first_month, n_months = 0, 0
+        if dated.any():
+            first_month = int(months[dated].min())
+            n_months = int(months[dated].max()) - first_month + 1
+        shape = tuple(len(label) for label in labels) + (n_months,)
+        flat = np.ravel_multi_index(
+            tuple(code[dated] for code in codes)
+            + (months[dated] - first_month,), shape)
+        counts = np.bincount(flat, minlength=int(np.prod(shape)))
+        cumulative = np.zeros(shape[:3] + (n_months + 1,), dtype=np.int64)
+        np.cumsum(counts.reshape(shape), axis=3, out=cumulative[..., 1:])
+        return cls(cumulative, first_month, *labels)
+
+    # (first, last) month number with any permits, or None if none are dated
+    def month_bounds(self):
+        n_months = self.cumulative.shape[3] - 1
+        if not n_months:
+            return None
+        return self.first_month, self.first_month + n_months - 1
+
+    # PermitCube of the permits dated in months [start, stop)
+    def range_cube(self, start, stop):
+        n_months = self.cumulative.shape[3] - 1
+        a, b = np.clip([start - self.first_month, stop - self.first_month],
+                       0, n_months)
+        counts = self.cumulative[..., max(b, a)] - self.cumulative[..., a]
+        return PermitCube(counts, self.zips, self.types, self.classes)
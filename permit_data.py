@@ -0,0 +1,124 @@
+import numpy as np  # pip install numpy==1.21.1
+import pandas as pd  # pip install pandas==1.2.3
+
+from date_index import DateIndex
+from map_bins import PermitBins
+from permit_cube import MonthlyCounts, PermitCube, month_numbers
+from spatial_index import GridIndex
+from zip_index import ZipIndex
+
+# Date the month range control filters on. AppliedDate is set on nearly every
+# permit while IssuedDate is empty until a permit is issued.
+range_date_col = 'AppliedDate'
+
+
+# Values of a column at positions; categoricals as codes into categories
+# (labels not in them get a code past the end) so that two snapshots'
+# codes compare directly
+def _aligned_values(column, positions, categories=None):
+    if categories is None:
+        return column.to_numpy()[positions]
+    codes = pd.Index(categories).get_indexer(column.cat.categories)
+    codes[codes < 0] = len(categories)
+    values = column.cat.codes.to_numpy()[positions]
+    return np.where(values < 0, -1, codes[values])
+
+
+# Changes between two cleaned snapshots keyed by PermitNum: permits only in
+# new, only in old, and in both with any column different (a status change,
+# a re-geocode, ...). None if PermitNum is not unique in either snapshot.
+# Columns are compared in their own dtypes (categoricals by code) on the
+# shared permits only, and nulls are only checked where values differ.
+def diff_permits(old, new):
+    old_ids = pd.Index(old['PermitNum'])
+    new_ids = pd.Index(new['PermitNum'])
+    if not (old_ids.is_unique and new_ids.is_unique):
+        return None
+    # One lookup aligns the snapshots: shared permits, added and removed
+    old_of_new = old_ids.get_indexer(new_ids)
+    new_pos = np.flatnonzero(old_of_new >= 0)
+    old_pos = old_of_new[new_pos]
+    removed = np.ones(len(old_ids), dtype=bool)
+    removed[old_pos] = False
+    changed = np.zeros(len(new_pos), dtype=bool)
+    for col in old.columns.drop('PermitNum'):
+        categories = None
+        if (isinstance(old[col].dtype, pd.CategoricalDtype)
+                and isinstance(new[col].dtype, pd.CategoricalDtype)):
+            categories = old[col].cat.categories
+        a = _aligned_values(old[col], old_pos, categories)
+        b = _aligned_values(new[col], new_pos, categories)
+        differs = a != b
+        differs[differs] = ~(pd.isna(a[differs]) & pd.isna(b[differs]))
+        changed |= differs
+    return {'added': new_ids[old_of_new < 0],
+            'removed': old_ids[removed],
+            'changed': new_ids[new_pos[changed]]}
+
+
+# One immutable snapshot of everything the callbacks read: the cleaned
+# permits, the count cube and the frames and indexes derived from them.
+# Reloads build a new snapshot and swap it in whole, so a request that
+# started on the old one never sees a half-updated mix.
+class PermitData:
+
+    def __init__(self, df_has_loc, permit_cube, bin_levels=()):
+        self.df_has_loc = df_has_loc
+        self.permit_cube = permit_cube
+        self.bin_levels = list(bin_levels)
+
+        self.type_grouper = permit_cube.type_class_frame()
+        self.zip_type_g = permit_cube.zip_type_frame()
+        self.zip_class_g = permit_cube.zip_class_frame()
+        self.unique_zips = (df_has_loc['OriginalZip'].drop_duplicates()
+                            .sort_values().tolist())
+
+        # PermitNum lookup for the detail panel; unlike row positions it
+        # stays valid across reloads
+        self.permit_index = pd.Index(df_has_loc['PermitNum'])
+        # Row ranges per zip in the zip-sorted permit frame
+        self.loc_zip_index = ZipIndex(df_has_loc)
+        # Grid over permit coordinates for viewport queries
+        self.permit_grid = GridIndex(df_has_loc['Longitude'],
+                                     df_has_loc['Latitude'])
+        # Monthly count prefix sums and date order for the month range
+        self.monthly_counts = MonthlyCounts.from_permits(df_has_loc,
+                                                         range_date_col)
+        self.month_bounds = self.monthly_counts.month_bounds()
+        self.date_index = DateIndex(month_numbers(df_has_loc[range_date_col]))
+        # Binned permit counts for the zoomed-out map levels
+        self.permit_bins = (PermitBins(df_has_loc, self.bin_levels)
+                            if self.bin_levels else None)
+
+    # The permit row with this PermitNum (the first if repeated), or None
+    def permit_row(self, permit_num):
+        try:
+            loc = self.permit_index.get_loc(permit_num)
+        except (KeyError, TypeError):
+            return None
+        if not isinstance(loc, int):   # slice or mask for a repeated id
+            loc = np.arange(len(self.permit_index))[loc][0]
+        return self.df_has_loc.iloc[loc]
+
+    @classmethod
+    def from_frames(cls, frames, bin_levels=()):
+        return cls(frames['df_has_loc'],
+                   PermitCube.from_counts(frames['permit_counts']),
+                   bin_levels)
+
+    # Frames in the layout permit_cache stores
+    def to_frames(self):
+        return {'df_has_loc': self.df_has_loc,
+                'permit_counts': self.permit_cube.to_counts()}
+
+    # New snapshot for a freshly cleaned export, plus the sizes of its diff
+    # against this one. The export is already cleaned and zip-sorted, and
+    # its cube is one bincount, so it is used as is rather than patching
+    # this snapshot's rows: every other index is rebuilt from it anyway.
+    def apply_snapshot(self, new_df):
+        diff = diff_permits(self.df_has_loc, new_df)
+        sizes = ({'rebuilt': len(new_df)} if diff is None
+                 else {name: len(ids) for name, ids in diff.items()})
+        return (PermitData(new_df, PermitCube.from_permits(new_df),
+                           self.bin_levels),
+                sizes)
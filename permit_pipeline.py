@@ -0,0 +1,166 @@
+import pandas as pd  # pip install pandas==1.2.3
+from pandas.api.types import union_categoricals
+
+from metrics import pipeline_seconds
+from permit_cube import PermitCube
+
+not_active = ['Completed', 'Closed', 'Expired', 'Canceled', 'Withdrawn']
+
+permit_class_remap = {'Commercial': 'Non-Residential',
+                      'Institutional': 'Non-Residential',
+                      'Industrial': 'Non-Residential',
+                      'Vacant Land': 'Non-Residential'}
+
+# Columns kept for the dashboard
+cols = ['PermitNum', 'PermitClassMapRes', 'PermitTypeDesc',
+        'HousingUnitsRemoved', 'HousingUnitsAdded', 'OriginalZip',
+        'Longitude', 'Latitude', 'EstProjectCost', 'PermitClassMapped']
+
+# Extra columns only shown in the permit detail panel; may be null
+detail_cols = ['StatusCurrent', 'OriginalAddress1', 'Description']
+
+# Application and issue dates; IssuedDate is null until a permit is issued
+date_cols = ['AppliedDate', 'IssuedDate']
+
+# Every column of df_has_loc
+kept_cols = cols + detail_cols + date_cols
+
+permit_types = ['Addition/Alteration', 'New', 'Demolition']
+
+# Raw export columns the pipeline reads, with compact dtypes
+read_dtypes = {'PermitNum': 'object',
+               'StatusCurrent': 'category',
+               'PermitClass': 'category',
+               'PermitClassMapped': 'category',
+               'PermitTypeDesc': 'category',
+               'OriginalZip': 'float32',
+               'Latitude': 'float32',
+               'Longitude': 'float32',
+               'HousingUnitsRemoved': 'float32',
+               'HousingUnitsAdded': 'float32',
+               'EstProjectCost': 'float64',
+               'OriginalAddress1': 'object',
+               'Description': 'object',
+               'AppliedDate': 'object',
+               'IssuedDate': 'object'}
+
+# Low-cardinality text columns stored as categoricals in df_has_loc
+category_cols = ['PermitClassMapRes', 'PermitTypeDesc', 'OriginalZip',
+                 'PermitClassMapped', 'StatusCurrent']
+
+chunk_rows = 100000
+
+
+def _count_stage(stats, stage, df):
+    if stats is not None:
+        stats[stage] = stats.get(stage, 0) + len(df)
+
+
+# Filter the raw export down to active, located permits of the types we chart.
+# Every step is row-local, so this runs equally on the whole export or on a
+# chunk of it; pass a stats dict to accumulate rows kept per stage.
+def clean_permits(df, stats=None):
+    _count_stage(stats, 'read', df)
+    df_active = df[~df['StatusCurrent'].isin(not_active)].copy()
+    _count_stage(stats, 'active', df_active)
+    df_active['PermitClassMapRes'] = (df_active['PermitClass'].astype(object)
+                                      .replace(permit_class_remap))
+
+    df_active = df_active[~df_active['OriginalZip'].isna()].copy()
+    df_active['OriginalZip'] = df_active['OriginalZip'].astype(int)
+    df_has_loc = df_active[~df_active['Latitude'].isna()]
+    df_has_loc = df_has_loc[df_has_loc.OriginalZip != 0].copy()
+    _count_stage(stats, 'has_zip_and_location', df_has_loc)
+
+    # Fill null values, keeping cost as text so the column has a single type
+    est_cost = df_has_loc['EstProjectCost']
+    df_has_loc['EstProjectCost'] = (est_cost.where(est_cost.isna(),
+                                                   est_cost.astype(str))
+                                    .fillna('Unknown'))
+    df_has_loc['HousingUnitsAdded'] = df_has_loc['HousingUnitsAdded'].fillna(0)
+    df_has_loc['HousingUnitsRemoved'] = (df_has_loc['HousingUnitsRemoved']
+                                         .fillna(0))
+
+    # Remove unneeded columns
+    df_has_loc = df_has_loc[kept_cols]
+
+    # Filter to just Additions, New, and Demo permits
+    df_has_loc = df_has_loc[df_has_loc['PermitTypeDesc'].isin(permit_types)]
+    _count_stage(stats, 'permit_type', df_has_loc)
+
+    # Remove rows with missing class
+    df_has_loc = df_has_loc.dropna(subset=cols)
+    _count_stage(stats, 'kept', df_has_loc)
+
+    # Parse dates, leaving unparseable ones null
+    df_has_loc = df_has_loc.assign(**{
+        col: pd.to_datetime(df_has_loc[col], errors='coerce')
+        for col in date_cols})
+
+    # Convert zips to strings
+    return df_has_loc.astype(dtype={'OriginalZip': 'str'})
+
+
+# Stitch cleaned chunks together, unioning each chunk's categories
+def _concat_chunks(chunks):
+    if not chunks:
+        return pd.DataFrame(columns=kept_cols).astype(
+            dict({col: 'category' for col in category_cols},
+                 **{col: 'datetime64[ns]' for col in date_cols}))
+    columns = {}
+    for col in kept_cols:
+        parts = [chunk[col] for chunk in chunks]
+        if col in category_cols:
+            columns[col] = pd.Categorical(union_categoricals(
+                [part.astype('category') for part in parts],
+                sort_categories=True))
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True).values
+    return pd.DataFrame(columns)[kept_cols]
+
+
+# Stream the export in chunks, reading only the needed columns with compact
+# dtypes, so peak memory is bounded by chunksize rather than the file size
+def read_permits(csv_path, chunksize=chunk_rows):
+    stats = {}
+    chunks = []
+    reader = pd.read_csv(csv_path, usecols=list(read_dtypes),
+                         dtype=read_dtypes, chunksize=chunksize)
+    while True:
+        with pipeline_seconds.time(stage='parse_csv'):
+            chunk = next(reader, None)
+        if chunk is None:
+            break
+        with pipeline_seconds.time(stage='clean'):
+            chunks.append(clean_permits(chunk, stats))
+    with pipeline_seconds.time(stage='concat'):
+        df_has_loc = _concat_chunks(chunks)
+    stats['memory_bytes'] = int(df_has_loc.memory_usage(deep=True).sum())
+    return df_has_loc, stats
+
+
+def format_stats(stats):
+    stages = ', '.join('{}={}'.format(stage, rows)
+                       for stage, rows in stats.items()
+                       if stage != 'memory_bytes')
+    return 'permit rows per stage: {}; df_has_loc {:.1f} MiB'.format(
+        stages, stats['memory_bytes'] / 2 ** 20)
+
+
+# Cleaned permits sorted by zip, so zip filters can use contiguous row ranges
+def load_permits(csv_path, chunksize=chunk_rows):
+    df_has_loc, stats = read_permits(csv_path, chunksize=chunksize)
+    print(format_stats(stats))
+    with pipeline_seconds.time(stage='sort'):
+        return df_has_loc.sort_values('OriginalZip', kind='mergesort',
+                                      ignore_index=True)
+
+
+# Run the full import-time pipeline on a CSV export
+def build_frames(csv_path, chunksize=chunk_rows):
+    df_has_loc = load_permits(csv_path, chunksize=chunksize)
+    # Count permits per (zip, type, class) for every chart aggregate
+    with pipeline_seconds.time(stage='cube'):
+        permit_counts = PermitCube.from_permits(df_has_loc).to_counts()
+    return {'df_has_loc': df_has_loc,
+            'permit_counts': permit_counts}
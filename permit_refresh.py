@@ -0,0 +1,73 @@
+import os
+import threading
+import traceback
+import urllib.error
+import urllib.request
+
+import permit_cache
+
+
+# Background thread that polls the permit export and calls
+# on_change(path, key) when its content changes, key being the new
+# permit_cache.source_key. The source is either the CSV itself (a local
+# file drop) or an HTTP URL that is downloaded over csv_path first.
+class PermitRefresher(threading.Thread):
+
+    def __init__(self, csv_path, on_change, interval=300, url=None,
+                 known_key=None):
+        super().__init__(name='permit-refresher', daemon=True)
+        self.csv_path = csv_path
+        self.on_change = on_change
+        self.interval = interval
+        self.url = url
+        # Fingerprint of the CSV the running data was built from
+        self._key = known_key
+        self._validators = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        if self._key is None:
+            self._key = permit_cache.source_key(self.csv_path)
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                traceback.print_exc()   # keep polling after a bad export
+
+    def stop(self):
+        self._stop_event.set()
+
+    # Download the feed only when its ETag or Last-Modified moved
+    def _download(self):
+        request = urllib.request.Request(self.url, headers=self._validators)
+        try:
+            response = urllib.request.urlopen(request, timeout=60)
+        except urllib.error.HTTPError as err:
+            if err.code == 304:
+                return
+            raise
+        with response:
+            tmp_path = '{}.{}.download'.format(self.csv_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                for block in iter(lambda: response.read(1 << 20), b''):
+                    f.write(block)
+            os.replace(tmp_path, self.csv_path)
+            self._validators = {
+                header: response.headers[source]
+                for header, source in (('If-None-Match', 'ETag'),
+                                       ('If-Modified-Since', 'Last-Modified'))
+                if response.headers.get(source)}
+
+    # Poll once; returns True if on_change was called
+    def check(self):
+        if self.url:
+            self._download()
+        stat = permit_cache.source_stat(self.csv_path)
+        if all(self._key.get(name) == value for name, value in stat.items()):
+            return False
+        key = dict(stat, sha256=permit_cache.file_hash(self.csv_path))
+        changed = key['sha256'] != self._key.get('sha256')
+        self._key = key
+        if changed:
+            self.on_change(self.csv_path, key)
+        return changed
@@ -0,0 +1,67 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import figure_bundle
+
+dashboard = None
+
+
+def _load_app():
+    global dashboard
+    import Seattle_Permits_Dashboard
+    dashboard = Seattle_Permits_Dashboard
+
+
+def _render(bundle_dir, key):
+    figure = dashboard.figure_renderers[key[0]](
+        dashboard.permit_data, sorted(key[-1]), *key[1:-1])
+    figure_bundle.write_artifacts(bundle_dir, key, figure)
+    return key
+
+
+# Cache keys of every bundled figure: the map by class and by type, and both
+# bar figures (each holding the percent and total chart), for all zips and
+# for each zip on its own, over the full month range
+def bundle_keys(unique_zips):
+    make_key = dashboard.FigureCache.make_key
+    keys = []
+    for slct_zip in [[]] + [[zip_code] for zip_code in unique_zips]:
+        keys.append(make_key('map', slct_zip, 0, None))
+        keys.append(make_key('map', slct_zip, 1, None))
+        keys.append(make_key('class_bars', slct_zip, None))
+        keys.append(make_key('type_bars', slct_zip, None))
+    return keys
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pre-render the dashboard figures for all zips and for '
+                    'each zip as gzipped figure JSON and standalone HTML')
+    parser.add_argument('bundle_dir', nargs='?', default='prerendered')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    # Render only: no refresher, warm-up or serving of an older bundle
+    os.environ.update(PERMITS_REFRESH_SECONDS='0', WARMUP_TOP_N='0',
+                      PRERENDERED_DIR='')
+    _load_app()
+    os.makedirs(args.bundle_dir, exist_ok=True)
+    keys = bundle_keys(dashboard.permit_data.unique_zips)
+
+    # Workers fork from this process where possible, sharing the loaded data
+    with ProcessPoolExecutor(max_workers=args.processes,
+                             initializer=_load_app) as pool:
+        for done, key in enumerate(pool.map(_render,
+                                            [args.bundle_dir] * len(keys),
+                                            keys), 1):
+            if done % 20 == 0 or done == len(keys):
+                print('rendered {}/{} figures'.format(done, len(keys)))
+
+    figure_bundle.write_manifest(args.bundle_dir,
+                                 dashboard.permit_source_key(),
+                                 dashboard.figure_settings, keys)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import cProfile
+import os
+import re
+import time
+
+import flask  # pip install Flask==2.0.1
+
+try:
+    from pyinstrument import Profiler  # pip install pyinstrument==4.0.3
+except ImportError:
+    Profiler = None
+
+
+# Profile every request to server and keep the profiles of those slower than
+# threshold_ms in out_dir: cProfile .prof files (open with snakeviz or
+# pstats) or, with tool='pyinstrument', HTML call trees. Profiling slows
+# every request down, so this is meant to be switched on while digging.
+def profile_slow_requests(server, threshold_ms, out_dir='profiles',
+                          tool='cprofile'):
+    if tool == 'pyinstrument' and Profiler is None:
+        raise ImportError('PROFILER=pyinstrument needs pyinstrument '
+                          'installed')
+    os.makedirs(out_dir, exist_ok=True)
+
+    @server.before_request
+    def start_profile():
+        profiler = Profiler() if tool == 'pyinstrument' else cProfile.Profile()
+        flask.g.profile = (profiler, time.perf_counter())
+        if tool == 'pyinstrument':
+            profiler.start()
+        else:
+            profiler.enable()
+
+    @server.after_request
+    def dump_slow_profile(response):
+        profiler, start = flask.g.pop('profile', (None, None))
+        if profiler is None:
+            return response
+        if tool == 'pyinstrument':
+            profiler.stop()
+        else:
+            profiler.disable()
+        elapsed_ms = (time.perf_counter() - start) * 1e3
+        if elapsed_ms < threshold_ms:
+            return response
+
+        # Callback requests all share one path, so name them by output
+        body = flask.request.get_json(silent=True) or {}
+        target = body.get('output') or flask.request.path
+        name = '{}-{:.0f}ms-{}'.format(
+            time.strftime('%Y%m%d-%H%M%S'), elapsed_ms,
+            re.sub(r'[^\w.-]+', '_', target).strip('_.') or 'index')
+        if tool == 'pyinstrument':
+            with open(os.path.join(out_dir, name + '.html'), 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.dump_stats(os.path.join(out_dir, name + '.prof'))
+        return response
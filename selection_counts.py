@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+
+# How often each cached figure was requested, keyed like FigureCache keys:
+# (figure, *options, frozenset of zips). Counts are merged into a JSON file
+# every save_interval seconds so they survive restarts and are shared by
+# workers; a concurrent save from another worker can drop a few counts,
+# which is fine for ranking. Each save also prunes the in-memory counts to
+# the max_entries most frequent, so new keys (zip subsets x month ranges)
+# cannot grow them without bound.
+class SelectionCounts:
+
+    def __init__(self, path=None, save_interval=60, max_entries=1000):
+        self.path = path
+        self.save_interval = save_interval
+        self.max_entries = max_entries
+        self._counts = Counter()
+        self._unsaved = Counter()
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+        if path:
+            self._counts.update(self._read())
+
+    @staticmethod
+    def _to_json(key, count):
+        return {'figure': key[0], 'options': list(key[1:-1]),
+                'zips': sorted(key[-1]), 'count': count}
+
+    # JSON turns tuple options (month ranges) into lists; turn them back
+    @staticmethod
+    def _from_json(entry):
+        options = tuple(tuple(option) if isinstance(option, list) else option
+                        for option in entry['options'])
+        return ((entry['figure'],) + options + (frozenset(entry['zips']),))
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return Counter()
+        return Counter({self._from_json(entry): entry['count']
+                        for entry in entries})
+
+    def record(self, key):
+        with self._lock:
+            self._counts[key] += 1
+            self._unsaved[key] += 1
+            due = time.monotonic() - self._saved_at >= self.save_interval
+        if due:
+            self.save()
+
+    # Add this process's new counts to what is on disk, then keep and write
+    # back the max_entries most frequent
+    def save(self):
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, Counter()
+            self._saved_at = time.monotonic()
+            if not self.path:
+                self._counts = Counter(dict(
+                    self._counts.most_common(self.max_entries)))
+                return
+        counts = self._read()
+        counts.update(unsaved)
+        top = counts.most_common(self.max_entries)
+        with self._lock:
+            # Keep what was recorded while the file was read
+            self._counts = Counter(dict(top)) + self._unsaved
+        entries = [self._to_json(key, count) for key, count in top]
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    # The n most requested keys, most frequent first
+    def top(self, n):
+        with self._lock:
+            return [key for key, _ in self._counts.most_common(n)]
@@ -0,0 +1,79 @@
+import math
+
+import numpy as np  # pip install numpy==1.21.1
+
+
+# Uniform lon/lat grid over the permit points. Row positions are bucketed
+# by cell so a bounding-box query only touches the cells it overlaps.
+class GridIndex:
+
+    def __init__(self, lon, lat, cell_deg=0.01):
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.cell_deg = cell_deg
+        if len(self.lon):
+            self.lon0, self.lat0 = self.lon.min(), self.lat.min()
+            self.nx = int((self.lon.max() - self.lon0) // cell_deg) + 1
+            self.ny = int((self.lat.max() - self.lat0) // cell_deg) + 1
+        else:
+            self.lon0 = self.lat0 = 0.0
+            self.nx = self.ny = 0
+        cells = (self._row(self.lat) * self.nx + self._col(self.lon))
+        self.order = np.argsort(cells, kind='stable')
+        self.cells = cells[self.order]
+
+    def _col(self, lon):
+        return np.clip(((lon - self.lon0) // self.cell_deg).astype(np.int64),
+                       0, max(self.nx - 1, 0))
+
+    def _row(self, lat):
+        return np.clip(((lat - self.lat0) // self.cell_deg).astype(np.int64),
+                       0, max(self.ny - 1, 0))
+
+    # Sorted row positions of the points inside (west, south, east, north)
+    def query(self, bounds):
+        west, south, east, north = bounds
+        if not len(self.order) or west > east or south > north:
+            return np.empty(0, dtype=np.intp)
+        ix0, ix1 = self._col(np.array([west, east]))
+        iy0, iy1 = self._row(np.array([south, north]))
+        rows = np.arange(iy0, iy1 + 1)
+        starts = np.searchsorted(self.cells, rows * self.nx + ix0, 'left')
+        stops = np.searchsorted(self.cells, rows * self.nx + ix1, 'right')
+        pos = self.order[np.concatenate([np.arange(start, stop) for start, stop
+                                         in zip(starts, stops)])]
+        inside = ((self.lon[pos] >= west) & (self.lon[pos] <= east)
+                  & (self.lat[pos] >= south) & (self.lat[pos] <= north))
+        return np.sort(pos[inside])
+
+
+# Visible map from a mapbox relayoutData event as {'bounds': [west, south,
+# east, north], 'zoom': zoom}, or None if the event does not describe it
+def map_viewport(relayout_data, width, height):
+    if not relayout_data:
+        return None
+    zoom = relayout_data.get('mapbox.zoom')
+    derived = relayout_data.get('mapbox._derived')
+    if derived and derived.get('coordinates'):
+        lons, lats = zip(*derived['coordinates'])
+        return {'bounds': [min(lons), min(lats), max(lons), max(lats)],
+                'zoom': zoom}
+    center = relayout_data.get('mapbox.center')
+    if center is None or zoom is None:
+        return None
+    # Web mercator with 512px tiles, approximated as flat over the viewport
+    lon_span = width * 360 / (512 * 2 ** zoom)
+    lat_span = (height * 360 / (512 * 2 ** zoom)
+                * math.cos(math.radians(center['lat'])))
+    return {'bounds': [center['lon'] - lon_span / 2,
+                       center['lat'] - lat_span / 2,
+                       center['lon'] + lon_span / 2,
+                       center['lat'] + lat_span / 2],
+            'zoom': zoom}
+
+
+# Evenly spaced subset of positions so a map never draws more than cap points
+def cap_points(positions, cap):
+    if cap <= 0 or len(positions) <= cap:
+        return positions
+    return positions[np.linspace(0, len(positions) - 1, cap).astype(np.intp)]
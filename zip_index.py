@@ -0,0 +1,34 @@
+import numpy as np  # pip install numpy==1.21.1
+import pandas as pd  # pip install pandas==1.2.3
+
+
+# Maps each zip code to the contiguous row range it occupies in a frame
+# sorted by zip, so a zip filter becomes a concatenation of slices instead
+# of an isin scan over every row
+class ZipIndex:
+
+    def __init__(self, df, column='OriginalZip'):
+        zips = df[column]
+        codes, uniques = pd.factorize(zips)
+        if len(codes) and (np.diff(codes) < 0).any():
+            raise ValueError('frame must be sorted by {}'.format(column))
+        bounds = np.searchsorted(codes, np.arange(len(uniques) + 1))
+        self.column = column
+        self.size = len(df)
+        self.ranges = {zip_code: (bounds[i], bounds[i + 1])
+                       for i, zip_code in enumerate(uniques)}
+
+    def positions(self, slct_zip):
+        ranges = sorted(self.ranges[zip_code] for zip_code in set(slct_zip)
+                        if zip_code in self.ranges)
+        if not ranges:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([np.arange(start, stop)
+                               for start, stop in ranges])
+
+    # Rows of df (the frame the index was built on) in the selected zips,
+    # in the same order an isin filter would return them
+    def select(self, df, slct_zip):
+        if len(df) != self.size:
+            raise ValueError('index was built on a different frame')
+        return df.take(self.positions(slct_zip))